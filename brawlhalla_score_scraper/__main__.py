@@ -3,21 +3,6 @@ gui = GUI()
 gui.run()
 
 
-# from .constants import Positions
-# from .screen import is_on_scores_screen
-# import time
-# COUNT = 10
-#
-# times = []
-# for _ in range(COUNT):
-#     start = time.time()
-#     _ = is_on_scores_screen()
-#     times.append(time.time() - start)
-#
-#
-# print('TOTAL %.4f - AVG %.4f' % (sum(times), sum(times) / COUNT))
-
-
 # from .delegate import SocketDelegate, SocketEmitter
 # from typing import Any
 # from threading import Thread
@@ -1,8 +1,14 @@
+import os
 import time
 
 from .constants import *
 from .command_queue import CommandQueue
-from .database import Database
+from .database import Database, DatabaseWriter
+from .delegate import FanOutDelegate
+from .digits import DigitRecognizer, set_recognizer
+from .legends import LegendClassifier, set_classifier
+from .metrics import registry
+from .ocr import get_cache, get_engine, set_engine
 from .scores import ScoreScraper
 from .server.server import PlayerServer, PlayerServerDelegate
 
@@ -19,13 +25,23 @@ class BaseApplication(Runnable, PlayerServerDelegate):
 
 
 class Application(BaseApplication):
-    def __init__(self, db: Database, queue: CommandQueue):
+    def __init__(self, db: Database, queue: CommandQueue,
+                 ocr_cache_path: str = 'Brawlhalla_OCR_Cache.json',
+                 digit_templates_path: str = 'Brawlhalla_Digits.npz',
+                 legend_templates_path: str = 'Brawlhalla_Legends.npz'):
         self.db = db
         self.queue = queue
-        self.scraper = ScoreScraper(self.db)
+        self.ocr_cache_path = ocr_cache_path
+        self.digit_templates_path = digit_templates_path
+        self.legend_templates_path = legend_templates_path
+        self.writer = DatabaseWriter(self.db)
+        self.scraper = ScoreScraper(self.writer)
         self.server = PlayerServer(Application._get_local_ip())
+        # Changes of the player cache go to the server (pushed to browsers) and to subscribers added later
+        self.player_events = FanOutDelegate(self.server)
 
         self.queue.connect(self)
+        self.scraper.players.connect(self.player_events)
         self.server.delegate = self
 
     def run(self):
@@ -36,6 +52,20 @@ class Application(BaseApplication):
             for player in self.db.get_players():
                 self.scraper.players.add_player(player)
 
+            # From here on the database is only used by the writer thread
+            self.db.disconnect()
+            self.writer.start()
+
+            # Load OCR language data and previously read labels once before the first scoreboard
+            get_engine()
+            get_cache().load(self.ocr_cache_path)
+
+            # Read scores and legends by template matching instead of tesseract once templates have been built
+            if os.path.exists(self.digit_templates_path):
+                set_recognizer(DigitRecognizer.load(self.digit_templates_path))
+            if os.path.exists(self.legend_templates_path):
+                set_classifier(LegendClassifier.load(self.legend_templates_path))
+
             self.server.run()
             self.queue.listen()
 
@@ -43,13 +73,21 @@ class Application(BaseApplication):
         finally:
             self.scraper.stop()
             self.server.stop()
-            self.db.disconnect()
+            # Commits every write still queued
+            self.writer.close()
+            if self.db.connection is not None:
+                self.db.disconnect()
+            get_cache().save(self.ocr_cache_path)
+            set_engine(None)
 
     # region Detail
 
     def get_accounts(self):
         return sorted(self.scraper.players.accounts)
 
+    def get_metrics(self) -> str:
+        return registry.render()
+
     def check_event(self, event: str, data=None) -> int:
 
         if event == Events.Server.DeletePlayer:
@@ -89,6 +127,15 @@ class Application(BaseApplication):
         elif event == Events.Command.RemoveAccount:
             self.scraper.remove_account(data)
 
+        elif event == Events.Command.RebuildStats:
+            self.writer.rebuild_stats()
+
+        elif event == Events.Command.Export:
+            self.writer.export(data)
+
+        elif event == Events.Command.Import:
+            self.writer.import_matches(data)
+
     @staticmethod
     def _get_local_ip() -> str:
         import socket
@@ -106,10 +153,15 @@ class Application(BaseApplication):
 
 
 class ClientApplication(BaseApplication):
+    def __init__(self):
+        self.player_events = FanOutDelegate()
 
     def get_accounts(self):
         return []
 
+    def get_metrics(self) -> str:
+        return ''
+
     def run(self):
         try:
             while True:
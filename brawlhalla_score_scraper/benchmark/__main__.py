@@ -0,0 +1,69 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .benchmark import save
+from .bridge import benchmark_bridge, benchmark_push
+from .database import benchmark_import, benchmark_startup, benchmark_writes
+from .digits import benchmark_digits
+from .ocr import benchmark_ocr
+from .pipeline import benchmark_pipeline
+from .wire import benchmark_wire
+
+
+BENCHMARKS = {
+    'ocr': benchmark_ocr,
+    'digits': benchmark_digits,
+    'pipeline': benchmark_pipeline,
+    'writes': benchmark_writes,
+    'startup': benchmark_startup,
+    'import': benchmark_import,
+    'bridge': benchmark_bridge,
+    'push': benchmark_push,
+    'wire': benchmark_wire,
+}
+
+
+def compare(old: dict, new: dict):
+    """Prints the change of every p50/p95/p99 between two saved runs"""
+    print('Compared to %s' % old.get('timestamp', 'previous run'))
+    for benchmark, stages in new['results'].items():
+        for stage, stats in stages.items():
+            previous = old.get('results', {}).get(benchmark, {}).get(stage, {})
+            changes = ['%s %+.1f%%' % (p, 100 * (stats[p] / previous[p] - 1))
+                       for p in ('p50', 'p95', 'p99') if previous.get(p) and p in stats]
+            if changes:
+                print('  %-10s %-24s %s' % (benchmark, stage, '  '.join(changes)))
+
+
+def main(args: [str]):
+    parser = argparse.ArgumentParser(prog='python -m brawlhalla_score_scraper.benchmark')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (%s), all by default' % ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=20, help='iterations per benchmark')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='results file of a previous run to compare against')
+    options = parser.parse_args(args)
+
+    unknown = [n for n in options.names if n not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark(s): %s' % ', '.join(unknown))
+
+    results = {name: BENCHMARKS[name](repeat=options.repeat) for name in options.names or BENCHMARKS}
+    run = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': options.repeat,
+        'results': results,
+    }
+
+    if options.json:
+        save(options.json, run)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), run)
+
+
+main(sys.argv[1:])
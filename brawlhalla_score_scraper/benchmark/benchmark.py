@@ -0,0 +1,53 @@
+import json
+import time
+from typing import Callable
+
+from numpy import percentile
+
+
+__all__ = [
+    'measure',
+    'summarize',
+    'report',
+    'save',
+]
+
+
+def measure(f: Callable, repeat: int, warmup: int = 1) -> [float]:
+    for _ in range(warmup):
+        f()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times: [float]) -> {str: float}:
+    if not times:
+        return {'count': 0}
+    p50, p95, p99 = percentile(times, [50, 95, 99])
+    return {
+        'count': len(times),
+        'mean': sum(times) / len(times),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+    }
+
+
+def report(title: str, results: {str: {str: float}}):
+    print(title)
+    for name, stats in results.items():
+        if 'p50' not in stats:
+            print('  %-24s %s' % (name, ', '.join('%s=%s' % kv for kv in stats.items())))
+            continue
+        print('  %-24s p50 %9.3fms  p95 %9.3fms  p99 %9.3fms  (n=%d)' % (
+            name, stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000, stats['count']))
+
+
+def save(path: str, results: dict):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
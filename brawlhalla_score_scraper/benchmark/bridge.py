@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+import urllib.error
+import urllib.request
+from multiprocessing import Process
+from threading import Thread
+from typing import Any
+
+from ..constants import Events, Numbers
+from ..delegate import SocketDelegate, SocketEmitter
+from ..server.server import PlayerServer, PlayerServerDelegate
+from .benchmark import summarize, report
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+__all__ = [
+    'benchmark_bridge',
+    'benchmark_push',
+]
+
+
+# Local port of the emitter used for the direct round trips
+PORT = 5101
+
+
+class EchoDelegate(SocketDelegate):
+    """Delegate process answering every check with 0, the cheapest possible application"""
+
+    def check_event(self, event: str, data: Any = None) -> int:
+        return 0
+
+
+class BenchmarkServerDelegate(PlayerServerDelegate):
+
+    def get_accounts(self) -> [str]:
+        return ['account_%d' % i for i in range(8)]
+
+    def get_metrics(self) -> str:
+        return ''
+
+    def check_event(self, event: str, data: Any = None) -> int:
+        return 0
+
+    def on_event(self, event: str, data: Any = None):
+        pass
+
+
+def _run_echo_delegate(port: int, authkey: bytes):
+    EchoDelegate().connect(port, authkey)
+    while True:
+        time.sleep(1)
+
+
+def _concurrently(clients: int, requests: int, f) -> [float]:
+    """Latency of every call of f, with clients threads calling it requests times each"""
+    times = [[] for _ in range(clients)]
+
+    def run(latencies: [float]):
+        for _ in range(requests):
+            start = time.perf_counter()
+            f()
+            latencies.append(time.perf_counter() - start)
+
+    threads = [Thread(target=run, args=(latencies,)) for latencies in times]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [t for latencies in times for t in latencies]
+
+
+def _post_player():
+    request = urllib.request.Request('http://127.0.0.1:%d/?name=player_0&legend=petra' % Numbers.Port,
+                                     method='POST')
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def _idle_cpu(emitters: int, seconds: float = 1.0) -> float:
+    """CPU time used per second by a delegate connected to emitters idle emitters (in this process)"""
+    delegate = EchoDelegate()
+    connected = []
+    for i in range(emitters):
+        emitter = SocketEmitter()
+        emitter.connect(PORT + 1 + i)
+        delegate.connect(PORT + 1 + i)
+        emitter.wait_for_client()
+        connected.append(emitter)
+
+    try:
+        start = time.process_time()
+        time.sleep(seconds)
+        return (time.process_time() - start) / seconds
+    finally:
+        for emitter in connected:
+            emitter.close()
+
+
+def benchmark_bridge(repeat: int = 20, clients: (int,) = (1, 8, 32)) -> dict:
+    """
+    Latency of check_event round trips between processes and of on_event followed by a check
+    (the on_event is handled first), with 1, 8 and 32 threads sharing the connection. Then the
+    latency of adding a live player over HTTP (a check_event and an on_event through the player
+    server bridge) with as many concurrent HTTP clients, and the CPU used by an idle delegate.
+    """
+    requests = 10 * repeat
+    results = {'idle': {'cpu_seconds_per_second_%d_emitters' % n: round(_idle_cpu(n), 4) for n in (1, 8)}}
+
+    authkey = os.urandom(32)
+    emitter = SocketEmitter()
+    emitter.connect(PORT, authkey)
+    process = Process(target=_run_echo_delegate, args=(PORT, authkey), daemon=True)
+    process.start()
+    try:
+        emitter.wait_for_client()
+        emitter.check_event(Events.Server.SetPlayer)
+
+        def event_and_check():
+            emitter.on_event(Events.Server.SetPlayer, ['player_0', 'PETRA'])
+            emitter.check_event(Events.Server.SetPlayer, ['player_0', 'PETRA'])
+
+        for n in clients:
+            start = time.perf_counter()
+            times = _concurrently(n, requests, lambda: emitter.check_event(Events.Server.SetPlayer))
+            elapsed = time.perf_counter() - start
+            results['check_event_%d' % n] = summarize(times)
+            results['check_event_%d_rate' % n] = {'round_trips_per_second': round(len(times) / elapsed, 1)}
+            results['on_event_check_%d' % n] = summarize(_concurrently(n, requests, event_and_check))
+    finally:
+        process.terminate()
+        process.join()
+
+    server = PlayerServer('127.0.0.1', asynchronous=False)
+    server.delegate = BenchmarkServerDelegate()
+    server.run()
+    try:
+        # Wait for the server process to start listening
+        for _ in range(100):
+            try:
+                _post_player()
+                break
+            except urllib.error.URLError:
+                time.sleep(0.1)
+
+        for n in clients:
+            start = time.perf_counter()
+            times = _concurrently(n, requests, _post_player)
+            elapsed = time.perf_counter() - start
+            results['http_post_%d' % n] = summarize(times)
+            results['http_post_%d_rate' % n] = {'requests_per_second': round(len(times) / elapsed, 1)}
+    finally:
+        server.stop()
+
+    report('Delegate bridge round trips by number of concurrent clients', results)
+    return results
+
+
+async def _push_latencies(server: PlayerServer, viewers: int, repeat: int) -> [float]:
+    """Time from PlayerServer.on_event until the last of viewers WebSocket clients received the event"""
+    # The default connector holds at most 100 connections, the others would wait for one of them
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        sockets = [await session.ws_connect('http://127.0.0.1:%d/ws' % Numbers.Port) for _ in range(viewers)]
+        # Drain the live players sent on connection
+        for ws in sockets:
+            await ws.receive()
+
+        loop = asyncio.get_event_loop()
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            await loop.run_in_executor(None, server.on_event, Events.Player.UpdatedLivePlayers,
+                                       {'player_%d' % j: 'PETRA' for j in range(i % 4 + 1)})
+            await asyncio.gather(*(ws.receive() for ws in sockets))
+            times.append(time.perf_counter() - start)
+
+        for ws in sockets:
+            await ws.close()
+        return times
+
+
+def benchmark_push(repeat: int = 20, viewers: (int,) = (1, 100, 300)) -> dict:
+    """Latency of pushing live players to 1, 100 and 300 browsers connected to the asynchronous player server"""
+    if aiohttp is None:
+        print('Push benchmark skipped, aiohttp is not installed')
+        return {}
+
+    server = PlayerServer('127.0.0.1', asynchronous=True)
+    server.delegate = BenchmarkServerDelegate()
+    server.run()
+    results = {}
+    try:
+        for _ in range(100):
+            try:
+                _post_player()
+                break
+            except urllib.error.URLError:
+                time.sleep(0.1)
+        server.on_event(Events.Player.UpdatedLivePlayers, {'player_0': 'PETRA'})
+
+        for n in viewers:
+            results['push_%d' % n] = summarize(asyncio.run(_push_latencies(server, n, repeat)))
+    finally:
+        server.stop()
+
+    report('WebSocket push latency by number of connected browsers', results)
+    return results
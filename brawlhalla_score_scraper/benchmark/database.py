@@ -0,0 +1,172 @@
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from ..constants import Color, Legends
+from ..database import SQL, Database
+from ..importer import Columns
+from ..models import LivePlayer, Player, Score
+from .benchmark import summarize, report
+
+
+__all__ = [
+    'benchmark_import',
+    'benchmark_startup',
+    'benchmark_writes',
+    'random_matches',
+]
+
+
+def random_matches(count: int, players: int = 8, seed: int = 0) -> [[(LivePlayer, Score)]]:
+    rng = random.Random(seed)
+    roster = [Player('player_%d' % i, 'P%d' % (i % 10), Color(i, i, i)) for i in range(players)]
+    legends = sorted(Legends.all)
+    matches = []
+    for _ in range(count):
+        size = rng.randint(2, 4)
+        matches.append([
+            (LivePlayer(player, rng.choice(legends)),
+             Score(rank, (rng.randint(0, 500), rng.randint(0, 9), rng.randint(0, 9),
+                          rng.randint(0, 3), rng.randint(0, 2000), rng.randint(0, 2000))))
+            for rank, player in enumerate(rng.sample(roster, size), 1)])
+    return matches
+
+
+def benchmark_writes(repeat: int = 20, matches: int = 100) -> dict:
+    """
+    Write throughput of Database.add_scores when backfilling matches into a fresh
+    database file (repeat * matches matches in total)
+    """
+    directory = tempfile.mkdtemp()
+    db = Database(os.path.join(directory, 'writes.db'))
+    db.connect()
+
+    times = []
+    try:
+        for match in random_matches(repeat * matches):
+            start = time.perf_counter()
+            db.add_scores(match)
+            times.append(time.perf_counter() - start)
+    finally:
+        db.disconnect()
+        shutil.rmtree(directory)
+
+    results = {
+        'add_scores': summarize(times),
+        'throughput': {'matches_per_second': round(len(times) / sum(times), 1)},
+    }
+    report('Database.add_scores backfill of %d matches' % len(times), results)
+    return results
+
+
+def fill_matches(db: Database, count: int, chunk_size: int = 50000):
+    """Bulk inserts count synthetic matches (2 to 4 players each) after the ones already in the database"""
+    legends = sorted(Legends.all)
+    for i in range(8):
+        db.add_player(Player('player_%d' % i, 'P%d' % i, Color(i, i, i)))
+    players = dict(db.connection.execute(SQL.Player.SelectIds).fetchall())
+    legend_ids = dict(db.connection.execute(SQL.Legend.SelectIds).fetchall())
+
+    first = db.match_count
+    for start in range(first, first + count, chunk_size):
+        matches, individual = [], []
+        for match_id in range(start, min(start + chunk_size, first + count)):
+            ids = [players['player_%d' % ((match_id + i) % 8)] for i in range(2 + match_id % 3)]
+            matches.append((match_id, 'couch', 'stock', 0, len(ids)) + tuple(ids + [None] * (4 - len(ids))))
+            individual.extend((match_id, player_id, legend_ids[legends[(match_id + rank) % len(legends)]], 0, rank,
+                               100 * rank, rank, rank, 0, 500, 500) for rank, player_id in enumerate(ids, 1))
+        with db.transaction() as cursor:
+            cursor.executemany(SQL.Match.Insert, matches)
+            cursor.executemany(SQL.IndividualMatch.Insert, individual)
+    db.match_count = first + count
+
+
+def benchmark_startup(repeat: int = 20, sizes: (int,) = (10000, 100000, 1000000)) -> dict:
+    """
+    Time of Database.connect on databases holding 10k, 100k and 1M matches, and for
+    comparison the time of reading the whole match table
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'startup.db')
+    results = {}
+    try:
+        db = Database(path)
+        db.connect()
+        try:
+            for size in sizes:
+                fill_matches(db, size - db.match_count)
+
+                connect_times, scan_times = [], []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    other = Database(path)
+                    other.connect()
+                    connect_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    other.connection.execute(SQL.Match.SelectAll).fetchall()
+                    scan_times.append(time.perf_counter() - start)
+                    other.disconnect()
+
+                    assert other.match_count == size
+
+                results['connect_%d' % size] = summarize(connect_times)
+                results['select_all_%d' % size] = summarize(scan_times)
+        finally:
+            db.disconnect()
+    finally:
+        shutil.rmtree(directory)
+
+    report('Database.connect startup time by number of matches', results)
+    return results
+
+
+def write_history(path: str, results: int, players: int = 8, seed: int = 0):
+    """Writes a CSV history file with about the given number of individual results"""
+    rng = random.Random(seed)
+    legends = sorted(Legends.all)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(Columns)
+        match, written = 0, 0
+        while written < results:
+            size = rng.randint(2, 4)
+            for rank, player in enumerate(rng.sample(range(players), size), 1):
+                writer.writerow((match, 'player_%d' % player, rng.choice(legends), 0, rank, rng.randint(0, 500),
+                                 rng.randint(0, 9), rng.randint(0, 9), rng.randint(0, 3),
+                                 rng.randint(0, 2000), rng.randint(0, 2000)))
+            match += 1
+            written += size
+
+
+def benchmark_import(repeat: int = 20, size: int = 1000000) -> dict:
+    """Time of Database.import_matches loading a CSV history of a million individual results"""
+    directory = tempfile.mkdtemp()
+    history = os.path.join(directory, 'history.csv')
+    write_history(history, size)
+
+    times = []
+    try:
+        for i in range(max(1, repeat // 10)):
+            db = Database(os.path.join(directory, 'import_%d.db' % i))
+            db.connect()
+            for n in range(8):
+                db.add_player(Player('player_%d' % n, 'P%d' % n, Color(n, n, n)))
+            try:
+                start = time.perf_counter()
+                imported, rejected = db.import_matches(history)
+                times.append(time.perf_counter() - start)
+            finally:
+                db.disconnect()
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        'import_matches': summarize(times),
+        'throughput': {'results_per_second': round(size / (sum(times) / len(times)), 1)},
+    }
+    report('Database.import_matches of %d individual results (%d matches)' % (size, imported), results)
+    return results
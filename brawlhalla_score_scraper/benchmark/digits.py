@@ -0,0 +1,57 @@
+import random
+
+from ..digits import DigitRecognizer, set_recognizer
+from ..screen import get_score_data_from_image
+from .benchmark import measure, summarize, report
+from .synthetic import render_scores
+
+
+__all__ = [
+    'benchmark_digits',
+]
+
+
+def _random_scores(rng: random.Random) -> (int, int, int, int, int, int):
+    return (rng.randint(0, 999), rng.randint(0, 9), rng.randint(0, 9),
+            rng.randint(0, 9), rng.randint(0, 1999), rng.randint(0, 1999))
+
+
+def benchmark_digits(repeat: int = 20) -> dict:
+    """
+    Latency of reading the score areas of a 4 player scoreboard with tesseract
+    against the template matching digit recognizer, and the recognizer's accuracy
+    """
+    rng = random.Random(0)
+    training = [_random_scores(rng) for _ in range(50)]
+    recognizer = DigitRecognizer.build([(render_scores(values), values) for values in training])
+
+    boards = [[_random_scores(rng) for _ in range(4)] for _ in range(repeat)]
+    images = [[render_scores(values) for values in board] for board in boards]
+
+    def per_board():
+        remaining = iter(images)
+
+        def read_board():
+            for image in next(remaining):
+                get_score_data_from_image(image)
+        return measure(read_board, len(images), warmup=0)
+
+    results = {}
+    try:
+        set_recognizer(None)
+        results['tesseract'] = summarize(per_board())
+    except Exception as e:
+        results['tesseract'] = {'error': str(e)}
+
+    set_recognizer(recognizer)
+    try:
+        results['templates'] = summarize(per_board())
+        correct = sum(get_score_data_from_image(image) == values
+                      for board, board_images in zip(boards, images)
+                      for values, image in zip(board, board_images))
+        results['template_accuracy'] = {'correct': correct, 'total': 4 * repeat}
+    finally:
+        set_recognizer(None)
+
+    report('Score area recognition per 4 player scoreboard', results)
+    return results
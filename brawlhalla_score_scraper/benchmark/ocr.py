@@ -0,0 +1,57 @@
+from ..ocr import OCRCache, get_cache, set_cache
+from ..screen import *
+from ..screen import get_name_from_image, get_score_data_from_image, \
+    get_names_from_images, get_score_data_from_images
+from .benchmark import measure, summarize, report
+from .synthetic import render_scoreboard
+
+
+__all__ = [
+    'benchmark_ocr',
+]
+
+
+BOXES = [
+    ('PETRA', 'Player1', (420, 3, 1, 0, 812, 305)),
+    ('BODVAR', 'Player2', (260, 2, 2, 1, 530, 611)),
+    ('ORION', 'Player3', (150, 1, 3, 0, 344, 702)),
+    ('EMBER', 'Player4', (90, 0, 3, 2, 120, 790)),
+]
+
+
+def benchmark_ocr(repeat: int = 20) -> dict:
+    """
+    Latency of reading a 4 player scoreboard with one OCR call per crop (12 calls)
+    against one OCR call per mosaic of names, accounts and scores (3 calls)
+    """
+    frame = render_scoreboard('couch_4', BOXES)
+    offsets = probe_screen(frame).offsets
+
+    names = [frame.crop(o.name_region) for o in offsets]
+    accounts = [frame.crop(o.account_region) for o in offsets]
+    scores = [frame.crop(o.score_region) for o in offsets]
+
+    def per_crop():
+        for images in (names, accounts):
+            for image in images:
+                get_name_from_image(image)
+        for image in scores:
+            get_score_data_from_image(image)
+
+    def batched():
+        get_names_from_images(names)
+        get_names_from_images(accounts)
+        get_score_data_from_images(scores)
+
+    # Every run reads every crop, a cache holding nothing never answers
+    cache = get_cache()
+    set_cache(OCRCache(size=0))
+    try:
+        results = {
+            'per_crop': summarize(measure(per_crop, repeat)),
+            'mosaic': summarize(measure(batched, repeat)),
+        }
+    finally:
+        set_cache(cache)
+    report('OCR latency per 4 player scoreboard', results)
+    return results
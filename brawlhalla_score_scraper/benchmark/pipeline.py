@@ -0,0 +1,185 @@
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from ..constants import Events, Legends, Sizes
+from ..database import Database, DatabaseWriter
+from ..delegate import Delegate
+from ..digits import DigitRecognizer, set_recognizer
+from ..legends import LegendClassifier, set_classifier
+from ..models import Player
+from ..ocr import OCRCache, get_cache
+from ..scores import PlayerCache, ScoreScraper
+from ..screen import *
+from ..screen import Region, preprocess_name_image
+from .benchmark import summarize, report
+from .synthetic import render_scoreboard, render_label, render_scores
+
+
+__all__ = [
+    'benchmark_pipeline',
+]
+
+
+BOXES = [
+    ('PETRA', 'Player1', (420, 3, 1, 0, 812, 305)),
+    ('BODVAR', 'Player2', (260, 2, 2, 1, 530, 611)),
+    ('ORION', 'Player3', (150, 1, 3, 0, 344, 702)),
+    ('EMBER', 'Player4', (90, 0, 3, 2, 120, 790)),
+]
+
+LAYOUTS = {'couch_%d' % n: BOXES[:n] for n in (2, 3, 4)}
+
+# Replay time at which the scoreboard appears in the end to end runs
+SCOREBOARD_TIME = 5.0
+
+
+class SimulatedClock(ReplayFrameSource):
+    """
+    Replay that never waits: sleeping advances the clock instantly while time spent
+    processing still counts, so latencies include both polling delays and work.
+    """
+
+    def __init__(self, frames):
+        super().__init__(frames, realtime=False)
+        self._wall_start = time.perf_counter()
+
+    def time(self) -> float:
+        return self.timestamps[0] + self._elapsed + time.perf_counter() - self._wall_start
+
+
+class TimedWriter(DatabaseWriter):
+    """Records the replay and wall time every match is queued at"""
+
+    def __init__(self, source: SimulatedClock):
+        super().__init__(Database(':memory:'))
+        self.source = source
+        self.queued_at = None
+
+    def add_scores(self, scores):
+        self.queued_at = (self.source.time(), time.perf_counter())
+        super().add_scores(scores)
+
+
+class CommitRecorder(Delegate):
+    """
+    Stops the scraper and records the replay time once a match is committed (NewScores is sent).
+    The scraper keeps advancing the simulated clock while the writer thread commits, so the commit
+    time is the replay time the scores were queued at plus the wall time the commit took.
+    """
+
+    def __init__(self, writer: TimedWriter, scraper: ScoreScraper):
+        self.writer = writer
+        self.scraper = scraper
+        self.committed_at = None
+
+    def on_event(self, event: str, data=None):
+        if event == Events.Player.NewScores:
+            replay_time, wall_time = self.writer.queued_at
+            self.committed_at = replay_time + time.perf_counter() - wall_time
+            self.scraper.stop()
+
+
+def _use_templates(boards: {str: 'Frame'}):
+    """Selects template recognizers for scores and legends and caches account labels (runs without tesseract)"""
+    training = [values for _, _, values in BOXES] + [(1234567890, 0, 0, 0, 0, 0)]
+    set_recognizer(DigitRecognizer.build([(render_scores(values), values) for values in training]))
+    set_classifier(LegendClassifier.build([(render_label(legend, Sizes.NameLabel), legend) for legend in Legends.all]))
+
+    for layout, frame in boards.items():
+        for offset, (_, account, _) in zip(probe_screen(frame).offsets, LAYOUTS[layout]):
+            # Known accounts, usable right away instead of after agreeing reads
+            get_cache().put(OCRCache.hash(preprocess_name_image(frame.crop(offset.account_region))), account,
+                            reads=get_cache().confirmations)
+
+
+def _add_players(players: PlayerCache, boxes):
+    for i, (legend, account, _) in enumerate(boxes):
+        name = 'player_%d' % i
+        players.add_player(Player(name, 'P%d' % i, 0))
+        players.add_account(account)
+        players.set_live_player(players.named(name), legend)
+
+
+def benchmark_pipeline(repeat: int = 20, ocr: str = 'templates', batched: bool = True) -> dict:
+    """
+    Latency of every stage of reading a scoreboard (detection, layout selection, crop, OCR,
+    PlayerCache.add_scores and Database.add_scores) on synthetic 2, 3 and 4 player boards,
+    and the end to end latency from the scoreboard appearing to the match being committed
+    :param ocr: 'templates' (digit and legend templates, cached accounts) or 'tesseract'
+    """
+    boards = {layout: render_scoreboard(layout, boxes) for layout, boxes in LAYOUTS.items()}
+    if ocr == 'templates':
+        _use_templates(boards)
+
+    stages = defaultdict(list)
+    directory = tempfile.mkdtemp()
+    db = Database(os.path.join(directory, 'stages.db'))
+    db.connect()
+    probe = get_screen_probe()
+
+    try:
+        for _ in range(repeat):
+            for layout, board in boards.items():
+                set_frame_source(ReplayFrameSource([(0.0, board.pixels)], realtime=False))
+
+                start = time.perf_counter()
+                found = probe.match(grab_frame(probe.region))
+                detected = time.perf_counter()
+                result = probe.select(found)
+                selected = time.perf_counter()
+                frame = grab_frame(Region.bounding(
+                    r for o in result.offsets for r in (o.score_region, o.name_region, o.account_region)))
+                for o in result.offsets:
+                    frame.crop(o.score_region), frame.crop(o.name_region), frame.crop(o.account_region)
+                cropped = time.perf_counter()
+                scores = get_scores_from_screen(frame, result.offsets, batched=batched)
+                read = time.perf_counter()
+
+                players = PlayerCache()
+                _add_players(players, LAYOUTS[layout])
+                start_cache = time.perf_counter()
+                players.add_scores(scores)
+                cached = time.perf_counter()
+                db.add_scores(players.get_scores())
+                committed = time.perf_counter()
+
+                stages['detection'].append(detected - start)
+                stages['layout_selection'].append(selected - detected)
+                stages['crop'].append(cropped - selected)
+                stages['ocr'].append(read - cropped)
+                stages['player_cache'].append(cached - start_cache)
+                stages['database'].append(committed - cached)
+
+        for _ in range(repeat):
+            for layout, board in boards.items():
+                blank = board.pixels * 0
+                source = SimulatedClock([(0.0, blank), (SCOREBOARD_TIME, board.pixels), (SCOREBOARD_TIME + 60, board.pixels)])
+                set_frame_source(source)
+
+                writer = TimedWriter(source)
+                scraper = ScoreScraper(writer)
+                scraper.batched_ocr = batched
+                recorder = CommitRecorder(writer, scraper)
+                scraper.players.connect(recorder)
+                _add_players(scraper.players, LAYOUTS[layout])
+                writer.start()
+                try:
+                    scraper.run()
+                finally:
+                    writer.close()
+
+                if recorder.committed_at is not None:
+                    stages['end_to_end'].append(recorder.committed_at - SCOREBOARD_TIME)
+    finally:
+        db.disconnect()
+        set_frame_source(None)
+        if ocr == 'templates':
+            set_recognizer(None)
+            set_classifier(None)
+
+    results = {name: summarize(times) for name, times in stages.items()}
+    report('Scoreboard pipeline latency per stage (%s OCR, %s)' % (ocr, 'batched' if batched else 'per crop'),
+           results)
+    return results
@@ -0,0 +1,56 @@
+from numpy import zeros, uint8
+from PIL import Image, ImageDraw, ImageFont
+
+from ..constants import *
+from ..screen import Frame, ScoreBoxOffsets
+
+
+__all__ = [
+    'render_scoreboard',
+    'render_label',
+    'render_scores',
+]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype('DejaVuSans-Bold.ttf', size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_label(text: str, size: Size, color: Color = Colors.White, background: Color = Colors.Black) -> Image.Image:
+    image = Image.new('RGB', size, background)
+    ImageDraw.Draw(image).text((4, 4), text, fill=color, font=_font(size[1] - 10))
+    return image
+
+
+def render_scores(data: (int, int, int, int, int, int)) -> Image.Image:
+    image = Image.new('RGB', Sizes.ScoreArea, Colors.Black)
+    row = Sizes.ScoreArea.height // len(data)
+    draw = ImageDraw.Draw(image)
+    for i, value in enumerate(data):
+        draw.text((4, i * row + 2), str(value), fill=Colors.White, font=_font(row - 6))
+    return image
+
+
+def render_scoreboard(layout: str, boxes: [(str, str, (int, int, int, int, int, int))]) -> Frame:
+    """
+    Draws a full screen frame of the scoreboard for the given layout ('couch_2', 'couch_3' or 'couch_4'),
+    with the probe colors in place and one (legend, account, scores) label set per score box
+    """
+    pixels = zeros((Screen.Height, Screen.Width, 3), dtype=uint8)
+
+    for point in Positions.win_label_offsets():
+        pixels[point[1], point[0]] = Colors.WinLabel
+    for point in Positions.win_label_border_offsets():
+        pixels[point[1], point[0]] = Colors.WinLabelBorder
+
+    for offset, (legend, account, data) in zip(ScoreBoxOffsets.all()[layout], boxes):
+        pixels[offset.rank_offset[1], offset.rank_offset[0]] = Colors.RankLabel
+        for region, image in ((offset.name_region, render_label(legend, Sizes.NameLabel)),
+                              (offset.account_region, render_label(account, Sizes.AccountLabel)),
+                              (offset.score_region, render_scores(data))):
+            pixels[region.y:region.y + region.height, region.x:region.x + region.width] = image
+
+    return Frame(pixels)
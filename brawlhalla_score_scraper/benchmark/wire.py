@@ -0,0 +1,104 @@
+import pickle
+import random
+import time
+
+from ..constants import Color, Events, Legends
+from ..models import LivePlayer, Player, Score
+from ..wire import Decoder, Encoder, Kind
+from .benchmark import report
+
+
+__all__ = [
+    'benchmark_wire',
+]
+
+
+def session_events(count: int, players: int = 40, seed: int = 0) -> [tuple]:
+    """
+    on_event messages of a streaming session: players picking legends and accounts one at a
+    time (each event carrying the whole map, like PlayerCache), and the scores of finished matches
+    """
+    rng = random.Random(seed)
+    legends = sorted(Legends.all)
+    roster = {'player_%d' % i: Player('player_%d' % i, 'P%d' % (i % 10), Color(i, 2 * i % 256, 3 * i % 256))
+              for i in range(players)}
+    accounts = {'account_%d' % i for i in range(players)}
+    live, account_to_player = {}, {}
+
+    events = [(None, 'e', Events.Player.UpdatedPlayers, dict(roster)),
+              (None, 'e', Events.Player.UpdatedAccounts, set(accounts))]
+    while len(events) < count:
+        kind = rng.random()
+        name = 'player_%d' % rng.randrange(players)
+        if kind < 0.4:
+            live[name] = rng.choice(legends)
+            events.append((None, 'e', Events.Player.UpdatedLivePlayers, live))
+        elif kind < 0.7:
+            account_to_player['account_%d' % rng.randrange(players)] = name
+            events.append((None, 'e', Events.Player.UpdatedPlayerAccounts, account_to_player))
+        elif kind < 0.9:
+            scores = [(LivePlayer(roster['player_%d' % i], rng.choice(legends)),
+                       Score(rank, (rng.randint(0, 999), rng.randint(0, 9), rng.randint(0, 9),
+                                    rng.randint(0, 9), rng.randint(0, 1999), rng.randint(0, 1999))))
+                      for rank, i in enumerate(rng.sample(range(players), 4), 1)]
+            events.append((None, 'e', Events.Player.NewScores, scores))
+        else:
+            events.append((len(events), 'c', Events.Server.SetPlayer, [name, rng.choice(legends)]))
+        # Snapshot the maps as they were when the event was sent
+        events[-1] = events[-1][:3] + (_copy(events[-1][3]),)
+    return events
+
+
+def _copy(data):
+    return dict(data) if isinstance(data, dict) else set(data) if isinstance(data, set) else data
+
+
+def benchmark_wire(repeat: int = 20, events: int = 2000, batch: int = 16) -> dict:
+    """
+    Throughput (events/s encoded and decoded) and size (bytes per event) of the wire encoding
+    against pickling every message, one event per frame and batch events per frame
+    """
+    messages = session_events(events)
+    results = {}
+
+    def run(name: str, encode, decode, size: int):
+        frames = [messages[i:i + size] for i in range(0, len(messages), size)]
+        encode_time = decode_time = 0.0
+        total = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoded = encode(frames)
+            encode_time += time.perf_counter() - start
+            start = time.perf_counter()
+            decode(encoded)
+            decode_time += time.perf_counter() - start
+            total = sum(map(len, encoded))
+        results[name] = {
+            'bytes_per_event': round(total / len(messages), 1),
+            'encode_events_per_second': round(repeat * len(messages) / encode_time, 1),
+            'decode_events_per_second': round(repeat * len(messages) / decode_time, 1),
+        }
+
+    def pickle_encode(frames):
+        return [pickle.dumps(frame if len(frame) > 1 else frame[0], protocol=pickle.HIGHEST_PROTOCOL)
+                for frame in frames]
+
+    def pickle_decode(encoded):
+        for data in encoded:
+            pickle.loads(data)
+
+    def wire_encode(frames):
+        encoder = Encoder()
+        return [encoder.frame(Kind.Requests, frame) for frame in frames]
+
+    def wire_decode(encoded):
+        decoder = Decoder()
+        for data in encoded:
+            decoder.frame(data)
+
+    for size in (1, batch):
+        run('pickle_%d' % size, pickle_encode, pickle_decode, size)
+        run('wire_%d' % size, wire_encode, wire_decode, size)
+
+    report('Delegate message encoding of %d session events (1 and %d per frame)' % (len(messages), batch), results)
+    return results
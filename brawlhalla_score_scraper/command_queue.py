@@ -50,10 +50,15 @@ class CommandQueue(ABC, Emitter):
 
                 elif cmd == Events.Command.RemovePlayer \
                         or cmd == Events.Command.AddAccount \
-                        or cmd == Events.Command.RemoveAccount:
+                        or cmd == Events.Command.RemoveAccount \
+                        or cmd == Events.Command.Export \
+                        or cmd == Events.Command.Import:
 
                     for name in args:
                         self.on_event(cmd, name)
+
+                elif cmd == Events.Command.RebuildStats:
+                    self.on_event(cmd)
         finally:
             pass
 
@@ -63,5 +68,8 @@ class ConsoleCommandQueue(CommandQueue):
     def get_next_command_and_args(self) -> (str, [Any]):
         split = str(input('> ')).split(' ')
         if not split or len(split) < 2:
+            # Commands without arguments
+            if split and split[0].lower() == Events.Command.RebuildStats:
+                return split[0].lower(), []
             return 'error', ''
         return split[0].lower(), split[1:]
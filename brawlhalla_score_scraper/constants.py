@@ -65,6 +65,30 @@ class Colors:
 class Numbers:
     Port: int = 5000
 
+    # Seconds a SocketEmitter waits for the answer to a request
+    DelegateTimeout: float = 5.0
+
+    # Seconds between attempts of a SocketDelegate to connect to an emitter that is not listening yet
+    DelegateConnectInterval: float = 0.05
+
+    # Messages waiting to be sent to a browser of the player server before the oldest are dropped
+    WebSocketQueueSize: int = 64
+
+    # Seconds between pings keeping player server WebSockets alive (and detecting dead ones)
+    WebSocketHeartbeat: float = 30.0
+
+    # Matches waiting to be sent to an /events subscriber of the player server before the oldest are dropped
+    EventQueueSize: int = 32
+
+    # Last matches kept by the player server for /events subscribers resuming with Last-Event-ID
+    EventHistorySize: int = 256
+
+    # Seconds between comments sent on idle /events streams (detects disconnected subscribers)
+    EventKeepAlive: float = 15.0
+
+    # Milliseconds a disconnected /events subscriber waits before reconnecting
+    EventRetry: int = 500
+
     # Factor for ImageEnhance.Sharpness when processing name label
     NameLabelSharpnessEnhanceFactor: float = 5.0
 
@@ -74,6 +98,89 @@ class Numbers:
     # Threshold for account label color (all colors below this are blacked out)
     AccountLabelWhiteThreshold: int = 120
 
+    # Tesseract page segmentation mode for name labels (single line)
+    NameLabelPageSegMode: int = 7
+
+    # Tesseract page segmentation mode for the score area (uniform block of text)
+    ScoreAreaPageSegMode: int = 6
+
+    # Tesseract page segmentation mode for mosaics of several labels (uniform block of text)
+    MosaicPageSegMode: int = 6
+
+    # Height of the background band between crops stitched into one OCR mosaic
+    MosaicSeparator: int = 24
+
+    # Number of worker processes reading score boxes concurrently (0 reads them in the scraper thread)
+    OCRWorkers: int = 0
+
+    # Maximum number of name and account label OCR results kept in the cache
+    OCRCacheSize: int = 512
+
+    # Maximum number of differing hash bits for two labels to be considered the same. Labels differing
+    # in one character (Player1 and Player2) differ by as little as 1 bit, only exact hashes are safe
+    OCRCacheTolerance: int = 0
+
+    # Width and height of the difference hash of a label (width * height bits)
+    OCRCacheHashSize: Size = Size(32, 8)
+
+    # Agreeing OCR reads of a label before its text is served from the cache (a single misread is never reused)
+    OCRCacheConfirmations: int = 2
+
+    # Threshold for score digit color (all colors below this are background)
+    ScoreDigitWhiteThreshold: int = 150
+
+    # Size every score digit is sampled to before matching against the digit templates
+    ScoreDigitGlyphSize: Size = Size(12, 16)
+
+    # Size every name label is sampled to before matching against the legend templates
+    LegendTemplateSize: Size = Size(96, 16)
+
+    # Minimum correlation with a legend template for a name label to be classified without OCR
+    LegendMinConfidence: float = 0.8
+
+    # Maximum edit distance for an OCR'd name label to be corrected to a legend
+    LegendMaxEditDistance: int = 3
+
+    # Characters of an OCR'd label per allowed edit when correcting it (shorter labels are only matched exactly)
+    CharactersPerEdit: int = 4
+
+    # Maximum edit distance for an OCR'd account label to be corrected to a registered account
+    AccountMaxEditDistance: int = 2
+
+    # Every n-th pixel in both directions is compared when checking whether the screen changed
+    FrameGateStep: int = 8
+
+    # Mean pixel difference below which the screen is considered unchanged (not probed again)
+    FrameGateThreshold: float = 1.0
+
+    # Mean pixel difference above which the screen is considered to be transitioning (match end, menus)
+    SceneChangeThreshold: float = 24.0
+
+    # Polling intervals (fastest, during gameplay, static screen) in seconds while waiting for the scoreboard
+    # (no back-off on a static screen: the scoreboard can show up right after a frozen frame)
+    ScoresPollIntervals: (float, float, float) = (0.1, 0.25, 0.25)
+
+    # Polling intervals (fastest, during gameplay, static screen) in seconds while waiting for a new game
+    NewGamePollIntervals: (float, float, float) = (0.25, 0.5, 1.0)
+
+    # Factor the polling interval grows by every tick until it reaches its target
+    PollBackoff: float = 1.5
+
+    # Maximum number of database writes waiting for the writer thread (adding more blocks until it catches up)
+    WriteQueueSize: int = 256
+
+    # Maximum number of queued database writes committed together in one transaction
+    WriteBatchSize: int = 64
+
+    # Number of matches read from the database and written to an export at a time
+    ExportChunkSize: int = 10000
+
+    # Number of individual results inserted per transaction when importing match history
+    ImportBatchSize: int = 50000
+
+    # Number of matches copied per transaction when migrating a database to a newer schema
+    MigrationBatchSize: int = 10000
+
 
 def arr(*args):
     return array(args, dtype=np_int)
@@ -172,6 +279,9 @@ class Events:
         RemovePlayer: str = 'remove_player'
         AddAccount: str = 'add_account'
         RemoveAccount: str = 'remove_account'
+        RebuildStats: str = 'rebuild_stats'
+        Export: str = 'export'
+        Import: str = 'import'
 
     class Player:
         NewScores: str = 'player_new_scores'
@@ -180,6 +290,10 @@ class Events:
         UpdatedPlayerAccounts: str = 'player_updated_player_accounts'
         UpdatedLivePlayers: str = 'player_updated_live_players'
 
+    class Database:
+        Written: str = 'database_written'
+        Failed: str = 'database_failed'
+
     class Server:
         DeletePlayer: str = 'server_delete_player'
         SetAccount: str = 'server_set_account'
@@ -1,12 +1,23 @@
+import logging
 import sqlite3
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
 from functools import wraps
-
-from .constants import Color
+from queue import Queue
+from threading import Thread
+from typing import Any, Optional
+
+from .constants import Color, Events, Legends, Numbers
+from .delegate import Emitter
+from .export import get_export_writer
+from .importer import read_matches, validate_match
+from .metrics import registry
 from .models import *
 
 
 __all__ = [
     'Database',
+    'DatabaseWriter',
 ]
 
 
@@ -20,185 +31,705 @@ def check_connected(f):
     return wrapped
 
 
+def timed(operation: str):
+    return registry.histogram('database_operation_seconds', 'Time spent in database operations',
+                              operation=operation).timed
+
+
 class Database:
     def __init__(self, path: str):
         self.path = path
         self.connection = None
         self.match_count = 0
 
+    @timed('connect')
     def connect(self):
-        self.connection = sqlite3.connect(self.path)
+        # Transactions are opened explicitly (see transaction)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
         cursor = self.connection.cursor()
+        cursor.execute(SQL.JournalMode)
+        cursor.execute(SQL.Synchronous)
+
+        # The schema is only created (or upgraded) when the file is older than this version
+        version = cursor.execute(SQL.GetVersion).fetchone()[0]
+        if version > SQL.Version:
+            self.disconnect()
+            raise RuntimeError('Database schema version %d is newer than supported (%d)' % (version, SQL.Version))
+        if version < SQL.Version:
+            if cursor.execute(SQL.TableExists, (Tables.Match,)).fetchone():
+                # Files keyed by player names and legends (versions 0 to 2) are rewritten in place
+                self._migrate_to_integer_keys()
+            else:
+                with self.transaction() as cursor:
+                    self._create_schema(cursor)
+                    cursor.execute(SQL.SetVersion % SQL.Version)
+
+        # Legends added to the game since the file was created
+        with self.transaction() as cursor:
+            cursor.executemany(SQL.Legend.Insert, [(legend,) for legend in sorted(Legends.all)])
+
+        # Id of the next match, read from the primary key index instead of scanning the table
+        last_id = cursor.execute(SQL.Match.SelectLastId).fetchone()[0]
+        self.match_count = 0 if last_id is None else last_id + 1
+
+    def disconnect(self):
+        self.connection.close()
+        self.connection = None
+
+    # region Schema
+
+    @staticmethod
+    def _create_schema(cursor: sqlite3.Cursor):
         cursor.execute(SQL.Account.CreateTable)
         cursor.execute(SQL.Player.CreateTable)
+        cursor.execute(SQL.Legend.CreateTable)
         cursor.execute(SQL.Match.CreateTable)
         cursor.execute(SQL.IndividualMatch.CreateTable)
+        for statement in SQL.IndividualMatch.CreateIndexes:
+            cursor.execute(statement)
+        for table in SQL.StatsTables:
+            cursor.execute(table.CreateTable)
+
+    def _migrate_to_integer_keys(self, batch_size: int = Numbers.MigrationBatchSize):
+        """
+        Rewrites a file keyed by player names and legends to integer keys. The old tables are renamed,
+        the lookup tables filled from them and matches are copied batch_size at a time, one transaction
+        per batch. An interrupted migration continues with the first match that was not copied.
+        """
+        cursor = self.connection.cursor()
+        if not cursor.execute(SQL.TableExists, (SQL.Migration.Old % Tables.Match,)).fetchone():
+            with self.transaction() as cursor:
+                for statement in SQL.Migration.RenameTables:
+                    cursor.execute(statement)
+                self._create_schema(cursor)
+                for statement in SQL.Migration.CopyLookups:
+                    cursor.execute(statement)
+
+        while True:
+            with self.transaction() as cursor:
+                first_id = cursor.execute(SQL.Match.SelectLastId).fetchone()[0]
+                first_id = -1 if first_id is None else first_id
+                cursor.execute(SQL.Migration.CopyMatches, (first_id, batch_size))
+                if cursor.rowcount <= 0:
+                    break
+                last_id = cursor.execute(SQL.Match.SelectLastId).fetchone()[0]
+                cursor.execute(SQL.Migration.CopyIndividualMatches, (first_id, last_id))
+
+        with self.transaction() as cursor:
+            # Results of matches without a match row
+            cursor.execute(SQL.Migration.CopyIndividualMatches, (first_id, 2 ** 62))
+            for statement in SQL.Migration.DropTables:
+                cursor.execute(statement)
+            self.rebuild_stats()
+            cursor.execute(SQL.SetVersion % SQL.Version)
+
+        # Return the pages of the old tables to the file system
+        cursor.execute('VACUUM')
+
+    # endregion
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in one transaction, committed when the block exits and rolled back
+        if it raises. Transactions opened inside the block join the outer one as a savepoint,
+        so a failing inner block only undoes its own changes.
+        """
+        cursor = self.connection.cursor()
+        if self.connection.in_transaction:
+            cursor.execute('SAVEPOINT nested')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK TO nested')
+                cursor.execute('RELEASE nested')
+                raise
+            cursor.execute('RELEASE nested')
+            return
+
+        cursor.execute('BEGIN')
+        try:
+            yield cursor
+        except BaseException:
+            self.connection.rollback()
+            raise
         self.connection.commit()
 
-        cursor.execute(SQL.Match.SelectAll)
-        count = cursor.fetchall()
-        self.match_count = count[0] if count else 0
-
-    def disconnect(self):
-        self.connection.close()
-        self.connection = None
-
     @check_connected
+    @timed('get_accounts')
     def get_accounts(self) -> [str]:
         cursor = self.connection.cursor()
         cursor.execute(SQL.Account.SelectAll)
         return [row[0] for row in cursor.fetchall()]
 
     @check_connected
+    @timed('get_players')
     def get_players(self) -> [Player]:
         cursor = self.connection.cursor()
         cursor.execute(SQL.Player.SelectAll)
         return [Player.from_data(row[0], row[1], Color.from_int(row[2])) for row in cursor.fetchall()]
 
     @check_connected
+    @timed('add_account')
     def add_account(self, account: str) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute(SQL.Account.Insert(account))
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute(SQL.Account.Insert, (account,))
         return account != ""
 
     @check_connected
+    @timed('remove_account')
     def remove_account(self, account: str) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute(SQL.Account.Delete(account))
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute(SQL.Account.Delete, (account,))
         return account != ""
 
     @check_connected
+    @timed('add_player')
     def add_player(self, player: Player) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute(SQL.Player.Insert(player))
-        self.connection.commit()
-        return player.name != ""
+        with self.transaction() as cursor:
+            cursor.execute(SQL.Player.Insert, SQL.Player.values(player))
+            # Nothing is changed when the player is already registered (read before RELEASE resets it)
+            inserted = cursor.rowcount > 0
+        return inserted and player.name != ""
 
     @check_connected
+    @timed('remove_player')
     def remove_player(self, player: Player) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute(SQL.Player.Delete(player))
-        self.connection.commit()
+        # Removed players are kept (with their id) for the matches they played
+        with self.transaction() as cursor:
+            cursor.execute(SQL.Player.Remove, (player.name,))
         return player.name != ""
 
     @check_connected
+    @timed('add_scores')
     def add_scores(self, scores: [(LivePlayer, Score)]) -> bool:
         teams = False
         mode = 'couch'
         game_mode = 'stock'
         match_id = self.match_count
 
-        cursor = self.connection.cursor()
-        cursor.execute(SQL.Match.Insert(match_id, mode, game_mode, teams, scores))
+        with self.transaction() as cursor:
+            # Players and legends are referenced by id, make sure unregistered ones have one
+            cursor.executemany(SQL.Player.InsertRemoved, [(player.player.name,) for player, _ in scores])
+            cursor.executemany(SQL.Legend.Insert, [(player.legend,) for player, _ in scores])
 
-        for player, score in scores:
-            cursor.execute(SQL.IndividualMatch.Insert(match_id, player.player.name, player.legend, 0, score))
+            cursor.execute(SQL.Match.InsertNamed, SQL.Match.values(match_id, mode, game_mode, teams, scores))
+            cursor.executemany(SQL.IndividualMatch.InsertNamed, [
+                SQL.IndividualMatch.values(match_id, player.player.name, player.legend, 0, score)
+                for player, score in scores])
 
-        self.connection.commit()
+            # Stats are kept up to date in the same transaction as the match
+            cursor.executemany(SQL.PlayerStats.Upsert, [
+                (player.player.name,) + Aggregate.values(score) for player, score in scores])
+            cursor.executemany(SQL.LegendStats.Upsert, [
+                (player.legend,) + Aggregate.values(score) for player, score in scores])
+            cursor.executemany(SQL.PlayerLegendStats.Upsert, [
+                (player.player.name, player.legend) + Aggregate.values(score) for player, score in scores])
 
         self.match_count += 1
 
         return len(scores) > 0
 
+    def _insert_matches(self, matches: [tuple], results: [tuple]):
+        """Inserts the match and individual_match rows in one transaction (or savepoint) and clears them"""
+        with self.transaction() as cursor:
+            cursor.executemany(SQL.Match.Insert, matches)
+            cursor.executemany(SQL.IndividualMatch.Insert, results)
+        self.match_count += len(matches)
+        matches.clear()
+        results.clear()
+
+    @check_connected
+    @timed('get_player_stats')
+    def get_player_stats(self, player: Optional[str] = None) -> [Stats]:
+        """Stats of every player (or only the given one), most matches first"""
+        cursor = self.connection.cursor()
+        if player is None:
+            cursor.execute(SQL.PlayerStats.SelectAll)
+        else:
+            cursor.execute(SQL.PlayerStats.Select, (player,))
+        return [Stats.from_data(row[0], None, *row[1:]) for row in cursor.fetchall()]
+
+    @check_connected
+    @timed('get_legend_stats')
+    def get_legend_stats(self, legend: Optional[str] = None) -> [Stats]:
+        """Stats of every legend (or only the given one), most matches first"""
+        cursor = self.connection.cursor()
+        if legend is None:
+            cursor.execute(SQL.LegendStats.SelectAll)
+        else:
+            cursor.execute(SQL.LegendStats.Select, (legend,))
+        return [Stats.from_data(None, *row) for row in cursor.fetchall()]
+
+    @check_connected
+    @timed('get_player_legend_stats')
+    def get_player_legend_stats(self, player: Optional[str] = None, legend: Optional[str] = None) -> [Stats]:
+        """Stats of every player with every legend they played, optionally only for one player and/or legend"""
+        cursor = self.connection.cursor()
+        cursor.execute(SQL.PlayerLegendStats.Select, (player, player, legend, legend))
+        return [Stats.from_data(*row) for row in cursor.fetchall()]
+
+    @check_connected
+    @timed('export')
+    def export(self, path: str, chunk_size: int = Numbers.ExportChunkSize, incremental: bool = True) -> int:
+        """
+        Streams the match and individual_match tables into a columnar export, chunk_size matches
+        at a time so memory use does not grow with history. Paths ending in .npz are NumPy archives
+        of structured arrays, any other path is a directory of Parquet files (requires pyarrow).
+        :param incremental: only export matches newer than the last export to path (otherwise overwrite it)
+        :return: number of matches exported
+        """
+        writer = get_export_writer(path)
+        last_id = writer.last_exported() if incremental else None
+        if not incremental:
+            writer.clear()
+
+        exported = 0
+        cursor = self.connection.cursor()
+        while True:
+            matches = cursor.execute(SQL.Match.SelectChunk, (-1 if last_id is None else last_id, chunk_size)).fetchall()
+            if not matches:
+                break
+            first_id, last_id = matches[0][0], matches[-1][0]
+            cursor.execute(SQL.IndividualMatch.SelectChunk, (first_id, last_id))
+            writer.write(Tables.Match, first_id, last_id, matches)
+            writer.write(Tables.IndividualMatch, first_id, last_id, cursor.fetchall())
+            exported += len(matches)
+
+        return exported
+
+    @check_connected
+    @timed('import_matches')
+    def import_matches(self, path: str, batch_size: int = Numbers.ImportBatchSize) -> (int, [(int, str)]):
+        """
+        Bulk imports match history recorded by hand in CSV or JSON (see importer.read_results).
+        The import is one transaction: nothing is imported if it fails. Matches are inserted batch_size
+        at a time, the individual_match indexes are dropped during the import and the stats tables are
+        updated once at the end with the totals of all imported matches.
+        Matches with an invalid result (unknown player or legend, missing values) are skipped.
+        :return: number of imported matches and (line, reason) of every rejected result
+        """
+        cursor = self.connection.cursor()
+        players = dict(cursor.execute(SQL.Player.SelectIds).fetchall())
+        legends = dict(cursor.execute(SQL.Legend.SelectIds).fetchall())
+        accounts = set(self.get_accounts())
+        first_id = self.match_count
+        rejected = []
+
+        try:
+            with self.transaction() as cursor:
+                self._import_matches(cursor, path, batch_size, players, legends, accounts, first_id, rejected)
+        except BaseException:
+            # The batches were rolled back with the transaction
+            self.match_count = first_id
+            raise
+
+        return self.match_count - first_id, rejected
+
+    def _import_matches(self, cursor: sqlite3.Cursor, path: str, batch_size: int, players: {str: int},
+                        legends: {str: int}, accounts: {str}, first_id: int, rejected: [(int, str)]):
+        """Body of import_matches, in its transaction (each batch is a savepoint of it)"""
+        matches, results = [], []
+
+        for statement in SQL.IndividualMatch.DropIndexes:
+            cursor.execute(statement)
+
+        for match in read_matches(path):
+            converted, errors = validate_match(match, players, accounts)
+            if errors:
+                rejected.extend(errors)
+                continue
+
+            match_id = self.match_count + len(matches)
+            ids = [players[name] for name, *_ in converted] + [None] * (4 - len(converted))
+            teams = any(team for _, _, team, *_ in converted)
+            matches.append((match_id, 'couch', 'stock', int(teams), len(converted)) + tuple(ids))
+            results.extend((match_id, players[name], legends[legend]) + tuple(values)
+                           for name, legend, *values in converted)
+
+            if len(results) >= batch_size:
+                self._insert_matches(matches, results)
+        self._insert_matches(matches, results)
+
+        cursor.execute(SQL.Import.CreateStats, (first_id,))
+        for statement in SQL.Import.MergeStats:
+            cursor.execute(statement)
+        cursor.execute(SQL.Import.DropStats)
+
+        for statement in SQL.IndividualMatch.CreateIndexes:
+            cursor.execute(statement)
+
+    @check_connected
+    @timed('rebuild_stats')
+    def rebuild_stats(self) -> bool:
+        """Recomputes every stats table from the individual matches (e.g. after importing matches)"""
+        with self.transaction() as cursor:
+            for table in SQL.StatsTables:
+                cursor.execute(table.Clear)
+                cursor.execute(table.Rebuild)
+        return True
+
+
+class DatabaseWriter(Emitter):
+    """
+    Applies database writes on a dedicated thread that owns the connection, so the caller never waits
+    on sqlite. Writes are queued, committed in groups (one transaction for everything queued at the time)
+    and the outcome of each is reported with Events.Database.Written as (operation, data, result),
+    where operation is the name of the Database method that applied it. A write that raised is also
+    reported with Events.Database.Failed as (operation, data, error message).
+    Closing the writer waits until every queued write has been committed.
+    Reads of the running application (e.g. stats) go through query, in order with the writes.
+    """
+
+    def __init__(self, db: Database, capacity: int = Numbers.WriteQueueSize, batch_size: int = Numbers.WriteBatchSize):
+        super().__init__()
+        self.db = db
+        self.batch_size = batch_size
+        self._queue = Queue(maxsize=capacity)
+        self._thread = None
+        registry.gauge('database_write_queue_depth', 'Database writes waiting for the writer thread',
+                       function=self._queue.qsize)
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_stop)
+        self._thread.join()
+        self._thread = None
+
+    def add_account(self, account: str):
+        self._queue.put(('add_account', account))
+
+    def remove_account(self, account: str):
+        self._queue.put(('remove_account', account))
+
+    def add_player(self, player: Player):
+        self._queue.put(('add_player', player))
+
+    def remove_player(self, player: Player):
+        self._queue.put(('remove_player', player))
+
+    def add_scores(self, scores: [(LivePlayer, Score)]):
+        self._queue.put(('add_scores', scores))
+
+    def rebuild_stats(self):
+        self._queue.put(('rebuild_stats', None))
+
+    def export(self, path: str):
+        self._queue.put(('export', path))
+
+    def import_matches(self, path: str):
+        self._queue.put(('import_matches', path))
+
+    def query(self, operation: str, *args) -> Future:
+        """
+        Runs a read (the name of a Database method) on the writer thread, which owns the connection.
+        It sees every write queued before it.
+        :return: the future result of the method
+        """
+        if self._thread is None:
+            raise RuntimeError('Database writer is not running')
+        result = Future()
+        self._queue.put((_query, (operation, args, result)))
+        return result
+
+    def get_player_stats(self, player: Optional[str] = None) -> [Stats]:
+        return self.query('get_player_stats', player).result()
+
+    def get_legend_stats(self, legend: Optional[str] = None) -> [Stats]:
+        return self.query('get_legend_stats', legend).result()
+
+    def get_player_legend_stats(self, player: Optional[str] = None, legend: Optional[str] = None) -> [Stats]:
+        return self.query('get_player_legend_stats', player, legend).result()
+
+    # region Detail
+
+    def _run(self):
+        # sqlite connections can only be used by the thread that opened them
+        self.db.connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get())
+
+                writes = [write for write in batch if write is not _stop]
+                # Writes are committed in groups in queue order, long jobs run on their own in between
+                group = []
+                for operation, data in writes:
+                    if operation is _query:
+                        self._write(group)
+                        group = []
+                        self._answer(*data)
+                    elif operation in _jobs:
+                        self._write(group)
+                        group = []
+                        self._report(operation, data, *self._apply(operation, data))
+                    else:
+                        group.append((operation, data))
+                self._write(group)
+                if len(writes) < len(batch):
+                    break
+        finally:
+            self.db.disconnect()
+
+    def _write(self, batch: [(str, Any)]):
+        if not batch:
+            return
+
+        results = []
+        try:
+            with _commit_seconds.time(), self.db.transaction():
+                for operation, data in batch:
+                    results.append((operation, data) + self._apply(operation, data, nested=True))
+        except sqlite3.Error as e:
+            results = [(operation, data, False, str(e)) for operation, data in batch]
+
+        _commits.inc()
+        for result in results:
+            self._report(*result)
+
+    def _apply(self, operation: str, data: Any, nested: bool = False) -> (Any, Optional[str]):
+        """:return: the result of the operation and the error message if it raised"""
+        try:
+            method = getattr(self.db, operation)
+            # In a group the write is a savepoint, a failing write only rolls back its own changes
+            with self.db.transaction() if nested else nullcontext():
+                return (method() if data is None else method(data)), None
+        except (sqlite3.Error, OSError) as e:
+            # e.g. adding an account that already exists or importing a missing file
+            return False, str(e)
+        except Exception as e:
+            # e.g. exporting to Parquet without pyarrow, reported without losing the other writes
+            _log.exception('Database writer failed to apply %s(%r)', operation, data)
+            return False, str(e) or type(e).__name__
+
+    def _answer(self, operation: str, args: tuple, result: Future):
+        try:
+            result.set_result(getattr(self.db, operation)(*args))
+        except Exception as e:
+            result.set_exception(e)
+
+    def _report(self, operation: str, data: Any, result: Any, error: Optional[str]):
+        # The writer thread must survive delegates raising, it is the only one writing
+        try:
+            if error is not None:
+                self.on_event(Events.Database.Failed, (operation, data, error))
+            self.on_event(Events.Database.Written, (operation, data, result))
+        except Exception:
+            _log.exception('Delegate of the database writer failed on %s', operation)
+
+    # endregion
+
+
+_stop = object()
+# Operation of the reads queued by DatabaseWriter.query
+_query = object()
+# Operations taking long (file jobs opening their own transactions), not part of a group commit
+_jobs = frozenset(('export', 'import_matches'))
+_log = logging.getLogger(__name__)
+_commits = registry.counter('database_group_commits_total', 'Transactions committed by the database writer')
+_commit_seconds = registry.histogram('database_group_commit_seconds', 'Time spent committing a group of writes')
+
 
 # region SQL
 
-# Account -> (__name__)
-# Player -> (__name__, initials, color)
+# Account -> (__id__, name)
+# Player -> (__id__, name, initials, color, removed)
+# Legend -> (__id__, name)
 # Match -> (__id__, mode='couch', gameMode='stock', teams=0|1, playerCount,
-#           1st_name, 2nd_name*, 3rd_name*, 4th_name*)
-# IndividualMatch -> (__Match_id, player_name__, legend, team, score, kos, falls, accidents, dmg_done, dmg_taken)
+#           1st_player, 2nd_player*, 3rd_player*, 4th_player*)
+# IndividualMatch -> (__Match_id, player_id__, legend_id, team, score, kos, falls, accidents, dmg_done, dmg_taken)
+# PlayerStats -> (__player_id__, matches, wins, score, kos, falls, accidents, dmg_done, dmg_taken)
+# LegendStats -> (__legend_id__, matches, wins, ...)
+# PlayerLegendStats -> (__player_id, legend_id__, matches, wins, ...)
 
 class Tables:
     Account: str = 'account'
     Player: str = 'player'
+    Legend: str = 'legend'
     Match: str = 'match'
     IndividualMatch: str = 'individual_match'
+    PlayerStats: str = 'player_stats'
+    LegendStats: str = 'legend_stats'
+    PlayerLegendStats: str = 'player_legend_stats'
+
+
+class Aggregate:
+    """Columns shared by the stats tables"""
+
+    Columns: str = \
+        """Matches int NOT NULL,
+            Wins int NOT NULL,
+            Score int NOT NULL,
+            KOS int NOT NULL,
+            Falls int NOT NULL,
+            Accidents int NOT NULL,
+            DMG_Done int NOT NULL,
+            DMG_Taken int NOT NULL"""
+
+    # Stats columns of a stats table aliased as s
+    Fields: str = 's.Matches, s.Wins, s.Score, s.KOS, s.Falls, s.Accidents, s.DMG_Done, s.DMG_Taken'
+
+    # Adds the excluded (inserted) row to the existing one
+    Update: str = \
+        """Matches = Matches + excluded.Matches,
+            Wins = Wins + excluded.Wins,
+            Score = Score + excluded.Score,
+            KOS = KOS + excluded.KOS,
+            Falls = Falls + excluded.Falls,
+            Accidents = Accidents + excluded.Accidents,
+            DMG_Done = DMG_Done + excluded.DMG_Done,
+            DMG_Taken = DMG_Taken + excluded.DMG_Taken"""
+
+    # Totals of individual_match rows
+    Select: str = 'COUNT(*) AS Matches, SUM(Rank = 1) AS Wins, SUM(Score) AS Score, SUM(KOS) AS KOS, ' \
+                  'SUM(Falls) AS Falls, SUM(Accidents) AS Accidents, SUM(DMG_Done) AS DMG_Done, SUM(DMG_Taken) AS DMG_Taken'
+
+    # Totals of rows that are already totals
+    Sum: str = 'SUM(Matches), SUM(Wins), SUM(Score), SUM(KOS), SUM(Falls), ' \
+               'SUM(Accidents), SUM(DMG_Done), SUM(DMG_Taken)'
+
+    @staticmethod
+    def values(score: Score) -> tuple:
+        return (1, int(score.rank == 1), score.score, score.kos, score.falls,
+                score.accidents, score.dmg_done, score.dmg_taken)
+
+
+class Ids:
+    """Subqueries of the id of a player or legend name"""
+
+    Player: str = '(SELECT ID FROM %s WHERE Name = ?)' % Tables.Player
+    Legend: str = '(SELECT ID FROM %s WHERE Name = ?)' % Tables.Legend
 
 
 class SQL:
 
+    # Version of the schema created by Database.connect, stored in the file header (user_version)
+    Version: int = 3
+
+    GetVersion: str = 'PRAGMA user_version'
+    SetVersion: str = 'PRAGMA user_version = %d'
+
+    TableExists: str = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+
+    # Write-ahead logging lets readers continue during writes and makes commits a sequential append
+    JournalMode: str = 'PRAGMA journal_mode=WAL'
+
+    # In WAL mode NORMAL only syncs at checkpoints, a crash can lose the last commits but never corrupts
+    Synchronous: str = 'PRAGMA synchronous=NORMAL'
+
     class Account:
 
         CreateTable: str = \
-            """ CREATE TABLE IF NOT EXISTS %s ( 
-                Name varchar(64) NOT NULL,
-                PRIMARY KEY ( Name ) 
+            """ CREATE TABLE IF NOT EXISTS %s (
+                ID INTEGER PRIMARY KEY,
+                Name varchar(64) NOT NULL UNIQUE
             ); """ % (Tables.Account,)
 
-        SelectAll: str = 'SELECT * from %s' % Tables.Account
+        SelectAll: str = 'SELECT Name from %s' % Tables.Account
 
-        @staticmethod
-        def Insert(account: str) -> str:
-            return """INSERT INTO %s VALUES('%s')""" % (
-                Tables.Account, account)
+        Insert: str = 'INSERT INTO %s(Name) VALUES(?)' % Tables.Account
 
-        @staticmethod
-        def Delete(account: str):
-            return """DELETE FROM %s where Name = '%s'""" % (
-                Tables.Account, account)
+        Delete: str = 'DELETE FROM %s WHERE Name = ?' % Tables.Account
 
     class Player:
 
         CreateTable: str = \
-            """ CREATE TABLE IF NOT EXISTS %s ( 
-                Name varchar(64) NOT NULL, 
-                Initials char(2) NOT NULL, 
-                Color int NOT NULL, 
-                PRIMARY KEY ( Name ) 
+            """ CREATE TABLE IF NOT EXISTS %s (
+                ID INTEGER PRIMARY KEY,
+                Name varchar(64) NOT NULL UNIQUE,
+                Initials char(2) NOT NULL,
+                Color int NOT NULL,
+                Removed boolean NOT NULL DEFAULT 0
             ); """ % (Tables.Player,)
 
-        SelectAll: str = 'SELECT * FROM %s' % Tables.Player
-        SelectCount: str = 'SELECT COUNT(*) FROM %s' % Tables.Player
+        SelectAll: str = 'SELECT Name, Initials, Color FROM %s WHERE Removed = 0' % Tables.Player
+        SelectCount: str = 'SELECT COUNT(*) FROM %s WHERE Removed = 0' % Tables.Player
+        SelectIds: str = 'SELECT Name, ID FROM %s WHERE Removed = 0' % Tables.Player
 
-        @staticmethod
-        def Insert(player: Player) -> str:
-            return """INSERT INTO %s VALUES('%s', '%s', %d)""" % (
-                Tables.Player, player.name, player.initials, player.color.to_int())
+        # Registers the player again (keeping their id) if they were removed
+        Insert: str = 'INSERT INTO %s(Name, Initials, Color) VALUES(?, ?, ?) ON CONFLICT(Name) DO UPDATE SET ' \
+                      'Initials = excluded.Initials, Color = excluded.Color, Removed = 0 WHERE Removed = 1' \
+                      % Tables.Player
+
+        # Gives a name found in a match an id without registering it
+        InsertRemoved: str = "INSERT OR IGNORE INTO %s(Name, Initials, Color, Removed) VALUES(?, '', 0, 1)" \
+                             % Tables.Player
+
+        Remove: str = 'UPDATE %s SET Removed = 1 WHERE Name = ?' % Tables.Player
 
         @staticmethod
-        def Delete(player: Player):
-            return """DELETE FROM %s where Name = '%s'""" % (
-                Tables.Player, player.name)
+        def values(player: Player) -> (str, str, int):
+            return player.name, player.initials, player.color.to_int()
+
+    class Legend:
+
+        CreateTable: str = \
+            """ CREATE TABLE IF NOT EXISTS %s (
+                ID INTEGER PRIMARY KEY,
+                Name varchar(32) NOT NULL UNIQUE
+            ); """ % (Tables.Legend,)
+
+        SelectIds: str = 'SELECT Name, ID FROM %s' % Tables.Legend
+
+        Insert: str = 'INSERT OR IGNORE INTO %s(Name) VALUES(?)' % Tables.Legend
 
     class Match:
 
         CreateTable: str = \
             """CREATE TABLE IF NOT EXISTS %s (
-                ID int NOT NULL,
+                ID INTEGER PRIMARY KEY,
                 Mode varchar(16) NOT NULL,
                 GameMode varchar(16) NOT NULL,
                 Teams boolean NOT NULL,
                 PlayerCount int NOT NULL,
-                FirstName varchar(64) NOT NULL,
-                SecondName varchar(64) NULL,
-                ThirdName varchar(64) NULL,
-                FourthName varchar(64) NULL,
-                PRIMARY KEY (ID),
-                FOREIGN KEY (FirstName) REFERENCES %s(FirstName),
-                FOREIGN KEY (SecondName) REFERENCES %s(SecondName),
-                FOREIGN KEY (ThirdName) REFERENCES %s(ThirdName),
-                FOREIGN KEY (FourthName) REFERENCES %s(FourthName)
+                FirstPlayer int NOT NULL,
+                SecondPlayer int NULL,
+                ThirdPlayer int NULL,
+                FourthPlayer int NULL,
+                FOREIGN KEY (FirstPlayer) REFERENCES %s(ID),
+                FOREIGN KEY (SecondPlayer) REFERENCES %s(ID),
+                FOREIGN KEY (ThirdPlayer) REFERENCES %s(ID),
+                FOREIGN KEY (FourthPlayer) REFERENCES %s(ID)
             );""" % (Tables.Match, Tables.Player, Tables.Player, Tables.Player, Tables.Player)
 
         SelectAll: str = 'SELECT * FROM %s' % Tables.Match
         SelectCount: str = 'SELECT COUNT(*) FROM %s' % Tables.Match
+        SelectLastId: str = 'SELECT MAX(ID) FROM %s' % Tables.Match
+
+        # Matches after an id in id order, with player names (missing ones as '') for exports
+        SelectChunk: str = \
+            """SELECT m.ID, m.Mode, m.GameMode, m.Teams, m.PlayerCount,
+                IFNULL(p1.Name, ''), IFNULL(p2.Name, ''), IFNULL(p3.Name, ''), IFNULL(p4.Name, '')
+                FROM %s m
+                LEFT JOIN %s p1 ON p1.ID = m.FirstPlayer LEFT JOIN %s p2 ON p2.ID = m.SecondPlayer
+                LEFT JOIN %s p3 ON p3.ID = m.ThirdPlayer LEFT JOIN %s p4 ON p4.ID = m.FourthPlayer
+                WHERE m.ID > ? ORDER BY m.ID LIMIT ?""" \
+            % (Tables.Match, Tables.Player, Tables.Player, Tables.Player, Tables.Player)
+
+        Insert: str = 'INSERT INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)' % Tables.Match
+
+        # Same as Insert with player names instead of ids
+        InsertNamed: str = 'INSERT INTO %s VALUES(?, ?, ?, ?, ?, %s)' % (Tables.Match, ', '.join([Ids.Player] * 4))
 
         @staticmethod
-        def Insert(match_id: int, mode: str, game_mode: str, teams: bool, scores: [(LivePlayer, Score)]) -> str:
-            names = list(map(lambda x: "'" + x[0].player.name + "'", scores)) + ['NULL'] * (4 - len(scores))
-            return """INSERT INTO %s VALUES(%d,'%s','%s',%d,%d,%s,%s,%s,%s)""" % (
-                Tables.Match, match_id, mode, game_mode, teams, len(scores), names[0], names[1], names[2], names[3])
+        def values(match_id: int, mode: str, game_mode: str, teams: bool, scores: [(LivePlayer, Score)]) -> tuple:
+            names = [player.player.name for player, _ in scores] + [None] * (4 - len(scores))
+            return (match_id, mode, game_mode, int(teams), len(scores)) + tuple(names[:4])
 
     class IndividualMatch:
 
+        # Rows are stored in primary key order (no rowid), so results of a match are next to each other
         CreateTable: str = \
             """CREATE TABLE IF NOT EXISTS %s (
                 MatchID int NOT NULL,
-                PlayerName varchar(64) NOT NULL,
-                Legend varchar(32) NOT NULL,
+                PlayerID int NOT NULL,
+                LegendID int NOT NULL,
                 Team int NOT NULL,
                 Rank int NOT NULL,
                 Score int NOT NULL,
@@ -207,20 +738,182 @@ class SQL:
                 Accidents int NOT NULL,
                 DMG_Done int NOT NULL,
                 DMG_Taken int NOT NULL,
-                PRIMARY KEY (MatchID, PlayerName),
-                FOREIGN KEY (MatchID) REFERENCES %s(MatchID),
-                FOREIGN KEY (PlayerName) REFERENCES %s(PlayerName)
-            )""" % (Tables.IndividualMatch, Tables.Match, Tables.Player)
+                PRIMARY KEY (MatchID, PlayerID),
+                FOREIGN KEY (MatchID) REFERENCES %s(ID),
+                FOREIGN KEY (PlayerID) REFERENCES %s(ID),
+                FOREIGN KEY (LegendID) REFERENCES %s(ID)
+            ) WITHOUT ROWID""" % (Tables.IndividualMatch, Tables.Match, Tables.Player, Tables.Legend)
 
         SelectAll: str = 'SELECT * FROM %s' % Tables.IndividualMatch
         SelectCount: str = 'SELECT COUNT(*) FROM %s' % Tables.IndividualMatch
 
+        Insert: str = 'INSERT INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)' % Tables.IndividualMatch
+
+        # Same as Insert with the player name and legend instead of ids
+        InsertNamed: str = 'INSERT INTO %s VALUES(?, %s, %s, ?, ?, ?, ?, ?, ?, ?, ?)' \
+                           % (Tables.IndividualMatch, Ids.Player, Ids.Legend)
+
+        # Results of the matches with ids in a range, with player names and legends (for exports)
+        SelectChunk: str = \
+            """SELECT i.MatchID, p.Name, l.Name, i.Team, i.Rank, i.Score, i.KOS, i.Falls, i.Accidents,
+                i.DMG_Done, i.DMG_Taken FROM %s i JOIN %s p ON p.ID = i.PlayerID JOIN %s l ON l.ID = i.LegendID
+                WHERE i.MatchID BETWEEN ? AND ? ORDER BY i.MatchID, i.Rank""" \
+            % (Tables.IndividualMatch, Tables.Player, Tables.Legend)
+
         @staticmethod
-        def Insert(match_id: int, name: str, legend: str, team: int, score: Score) -> str:
-            return """INSERT INTO %s VALUES(%d,'%s','%s',%d,%d,%d,%d,%d,%d,%d,%d)""" % (
-                Tables.IndividualMatch, match_id, name, legend, team,
-                score.rank, score.score, score.kos, score.falls,
-                score.accidents, score.dmg_done, score.dmg_taken)
+        def values(match_id: int, name: str, legend: str, team: int, score: Score) -> tuple:
+            return (match_id, name, legend, team,
+                    score.rank, score.score, score.kos, score.falls,
+                    score.accidents, score.dmg_done, score.dmg_taken)
+
+        # MatchID lookups use the primary key
+        CreateIndexes: (str,) = (
+            'CREATE INDEX IF NOT EXISTS %s_player ON %s(PlayerID)' % (Tables.IndividualMatch, Tables.IndividualMatch),
+            'CREATE INDEX IF NOT EXISTS %s_legend ON %s(LegendID)' % (Tables.IndividualMatch, Tables.IndividualMatch),
+        )
+
+        DropIndexes: (str,) = (
+            'DROP INDEX IF EXISTS %s_player' % Tables.IndividualMatch,
+            'DROP INDEX IF EXISTS %s_legend' % Tables.IndividualMatch,
+        )
+
+    class PlayerStats:
+
+        CreateTable: str = \
+            """CREATE TABLE IF NOT EXISTS %s (
+                PlayerID INTEGER PRIMARY KEY,
+                %s
+            )""" % (Tables.PlayerStats, Aggregate.Columns)
+
+        SelectAll: str = 'SELECT p.Name, %s FROM %s s JOIN %s p ON p.ID = s.PlayerID ORDER BY s.Matches DESC, p.Name' \
+                         % (Aggregate.Fields, Tables.PlayerStats, Tables.Player)
+        Select: str = 'SELECT p.Name, %s FROM %s s JOIN %s p ON p.ID = s.PlayerID WHERE p.Name = ?' \
+                      % (Aggregate.Fields, Tables.PlayerStats, Tables.Player)
+
+        Upsert: str = 'INSERT INTO %s VALUES(%s, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(PlayerID) DO UPDATE SET %s' \
+                      % (Tables.PlayerStats, Ids.Player, Aggregate.Update)
+
+        Clear: str = 'DELETE FROM %s' % Tables.PlayerStats
+        # Summed from the player legend stats (rebuilt first) instead of all individual matches
+        Rebuild: str = 'INSERT INTO %s SELECT PlayerID, %s FROM %s GROUP BY PlayerID' \
+                       % (Tables.PlayerStats, Aggregate.Sum, Tables.PlayerLegendStats)
+
+    class LegendStats:
+
+        CreateTable: str = \
+            """CREATE TABLE IF NOT EXISTS %s (
+                LegendID INTEGER PRIMARY KEY,
+                %s
+            )""" % (Tables.LegendStats, Aggregate.Columns)
+
+        SelectAll: str = 'SELECT l.Name, %s FROM %s s JOIN %s l ON l.ID = s.LegendID ORDER BY s.Matches DESC, l.Name' \
+                         % (Aggregate.Fields, Tables.LegendStats, Tables.Legend)
+        Select: str = 'SELECT l.Name, %s FROM %s s JOIN %s l ON l.ID = s.LegendID WHERE l.Name = ?' \
+                      % (Aggregate.Fields, Tables.LegendStats, Tables.Legend)
+
+        Upsert: str = 'INSERT INTO %s VALUES(%s, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(LegendID) DO UPDATE SET %s' \
+                      % (Tables.LegendStats, Ids.Legend, Aggregate.Update)
+
+        Clear: str = 'DELETE FROM %s' % Tables.LegendStats
+        Rebuild: str = 'INSERT INTO %s SELECT LegendID, %s FROM %s GROUP BY LegendID' \
+                       % (Tables.LegendStats, Aggregate.Sum, Tables.PlayerLegendStats)
+
+    class PlayerLegendStats:
+
+        CreateTable: str = \
+            """CREATE TABLE IF NOT EXISTS %s (
+                PlayerID int NOT NULL,
+                LegendID int NOT NULL,
+                %s,
+                PRIMARY KEY (PlayerID, LegendID)
+            ) WITHOUT ROWID""" % (Tables.PlayerLegendStats, Aggregate.Columns)
+
+        # A None player or legend matches every row
+        Select: str = \
+            """SELECT p.Name, l.Name, %s FROM %s s JOIN %s p ON p.ID = s.PlayerID JOIN %s l ON l.ID = s.LegendID
+                WHERE (? IS NULL OR p.Name = ?) AND (? IS NULL OR l.Name = ?)
+                ORDER BY s.Matches DESC, p.Name, l.Name""" \
+            % (Aggregate.Fields, Tables.PlayerLegendStats, Tables.Player, Tables.Legend)
+
+        Upsert: str = 'INSERT INTO %s VALUES(%s, %s, ?, ?, ?, ?, ?, ?, ?, ?) ' \
+                      'ON CONFLICT(PlayerID, LegendID) DO UPDATE SET %s' \
+                      % (Tables.PlayerLegendStats, Ids.Player, Ids.Legend, Aggregate.Update)
+
+        Clear: str = 'DELETE FROM %s' % Tables.PlayerLegendStats
+        Rebuild: str = 'INSERT INTO %s SELECT PlayerID, LegendID, %s FROM %s GROUP BY PlayerID, LegendID' \
+                       % (Tables.PlayerLegendStats, Aggregate.Select, Tables.IndividualMatch)
+
+    # In rebuild order
+    StatsTables = (PlayerLegendStats, PlayerStats, LegendStats)
+
+    class Import:
+
+        # Totals of the imported matches (ids from ?) for every player with every legend
+        CreateStats: str = 'CREATE TEMP TABLE import_stats AS SELECT PlayerID, LegendID, %s FROM %s ' \
+                           'WHERE MatchID >= ? GROUP BY PlayerID, LegendID' % (Aggregate.Select, Tables.IndividualMatch)
+
+        DropStats: str = 'DROP TABLE IF EXISTS temp.import_stats'
+
+        # Adds the imported totals to the stats tables ("WHERE true" is required before ON CONFLICT)
+        MergeStats: (str,) = (
+            'INSERT INTO %s SELECT * FROM import_stats WHERE true ON CONFLICT(PlayerID, LegendID) DO UPDATE SET %s'
+            % (Tables.PlayerLegendStats, Aggregate.Update),
+            'INSERT INTO %s SELECT PlayerID, %s FROM import_stats WHERE true GROUP BY PlayerID '
+            'ON CONFLICT(PlayerID) DO UPDATE SET %s' % (Tables.PlayerStats, Aggregate.Sum, Aggregate.Update),
+            'INSERT INTO %s SELECT LegendID, %s FROM import_stats WHERE true GROUP BY LegendID '
+            'ON CONFLICT(LegendID) DO UPDATE SET %s' % (Tables.LegendStats, Aggregate.Sum, Aggregate.Update),
+        )
+
+    class Migration:
+        """Rewrite of files keyed by player names and legends (schema versions 0 to 2)"""
+
+        # Name of the old tables while they are copied
+        Old: str = '%s_v2'
+
+        RenameTables: (str,) = tuple(
+            'ALTER TABLE %s RENAME TO %s_v2' % (table, table)
+            for table in (Tables.Account, Tables.Player, Tables.Match, Tables.IndividualMatch)
+        ) + (
+            'DROP INDEX IF EXISTS %s_player' % Tables.IndividualMatch,
+            'DROP INDEX IF EXISTS %s_legend' % Tables.IndividualMatch,
+            'DROP TABLE IF EXISTS %s' % Tables.PlayerStats,
+            'DROP TABLE IF EXISTS %s' % Tables.LegendStats,
+            'DROP TABLE IF EXISTS %s' % Tables.PlayerLegendStats,
+        )
+
+        # Names only found in matches (of removed players) and legends played get an id too
+        CopyLookups: (str,) = (
+            'INSERT INTO {0}(Name) SELECT Name FROM {0}_v2'.format(Tables.Account),
+            'INSERT INTO {0}(Name, Initials, Color) SELECT Name, Initials, Color FROM {0}_v2'.format(Tables.Player),
+            "INSERT OR IGNORE INTO {0}(Name, Initials, Color, Removed) SELECT DISTINCT PlayerName, '', 0, 1 "
+            "FROM {1}_v2".format(Tables.Player, Tables.IndividualMatch),
+            "INSERT OR IGNORE INTO {0}(Name, Initials, Color, Removed) SELECT Name, '', 0, 1 FROM ("
+            "SELECT FirstName AS Name FROM {1}_v2 UNION SELECT SecondName FROM {1}_v2 UNION "
+            "SELECT ThirdName FROM {1}_v2 UNION SELECT FourthName FROM {1}_v2) WHERE Name IS NOT NULL"
+            .format(Tables.Player, Tables.Match),
+            'INSERT OR IGNORE INTO {0}(Name) SELECT DISTINCT Legend FROM {1}_v2'.format(Tables.Legend,
+                                                                                       Tables.IndividualMatch),
+        )
+
+        # The next ? matches after the match id ?
+        CopyMatches: str = \
+            """INSERT INTO {0} SELECT m.ID, m.Mode, m.GameMode, m.Teams, m.PlayerCount, p1.ID, p2.ID, p3.ID, p4.ID
+                FROM {0}_v2 m
+                LEFT JOIN {1} p1 ON p1.Name = m.FirstName LEFT JOIN {1} p2 ON p2.Name = m.SecondName
+                LEFT JOIN {1} p3 ON p3.Name = m.ThirdName LEFT JOIN {1} p4 ON p4.Name = m.FourthName
+                WHERE m.ID > ? ORDER BY m.ID LIMIT ?""".format(Tables.Match, Tables.Player)
+
+        # Results of the matches with ids after ? up to ?
+        CopyIndividualMatches: str = \
+            """INSERT INTO {0} SELECT i.MatchID, p.ID, l.ID, i.Team, i.Rank, i.Score, i.KOS, i.Falls, i.Accidents,
+                i.DMG_Done, i.DMG_Taken FROM {0}_v2 i
+                JOIN {1} p ON p.Name = i.PlayerName JOIN {2} l ON l.Name = i.Legend
+                WHERE i.MatchID > ? AND i.MatchID <= ?""".format(Tables.IndividualMatch, Tables.Player, Tables.Legend)
+
+        DropTables: (str,) = tuple(
+            'DROP TABLE %s_v2' % table
+            for table in (Tables.Account, Tables.Player, Tables.Match, Tables.IndividualMatch)
+        )
 
 
 # endregion
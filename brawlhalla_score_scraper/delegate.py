@@ -1,12 +1,25 @@
+import logging
+import socket
 import time
 from abc import ABC
-from multiprocessing.connection import Client, Listener
-from threading import Thread
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from itertools import count
+from multiprocessing import AuthenticationError, Pipe
+from multiprocessing.connection import Client, Connection, Listener, wait
+from threading import Event, Lock, Thread
 from typing import Any, Optional
 
+from .constants import Numbers
+from .wire import Decoder, Encoder, Kind
+
+
 __all__ = [
     'Delegate',
+    'DelegateError',
     'Emitter',
+    'FanOutDelegate',
+    'SocketDelegate',
+    'SocketEmitter',
     'check_event', 'on_event'
 ]
 
@@ -34,6 +47,30 @@ class Emitter:
         on_event(self.delegate, event, data)
 
 
+class FanOutDelegate(Delegate):
+    """Forwards every event to each of its delegates, a check returns the first non zero answer"""
+
+    def __init__(self, *delegates: Delegate):
+        self.delegates = list(delegates)
+
+    def add(self, delegate: Delegate):
+        self.delegates.append(delegate)
+
+    def remove(self, delegate: Delegate):
+        self.delegates.remove(delegate)
+
+    def check_event(self, event: str, data: Any = None) -> int:
+        for delegate in self.delegates:
+            code = check_event(delegate, event, data)
+            if code:
+                return code
+        return False
+
+    def on_event(self, event: str, data: Any = None):
+        for delegate in self.delegates:
+            on_event(delegate, event, data)
+
+
 def check_event(delegate: Optional[Delegate], event: str, data: Any = None) -> int:
     if delegate is not None:
         return delegate.check_event(event, data)
@@ -45,69 +82,270 @@ def on_event(delegate: Optional[Delegate], event: str, data: Any = None):
         delegate.on_event(event, data)
 
 
+class DelegateError(Exception):
+    """Raised by SocketEmitter.request when the SocketDelegate raised while answering the request"""
+
+
 class SocketDelegate(Delegate):
+    """
+    Answers the events of SocketEmitters in other processes. Requests are (id, code, event, data),
+    every request with an id is answered with (id, result) in the order it was received.
+    Code 'c' is check_event, 'e' is on_event (never answered) and others go to on_custom_event.
+    One thread serves every connected emitter, it blocks until a request arrives.
+    Messages are sent as frames of the wire module, the answers of a pass share one frame.
+    A request that raises is logged and answered with a DelegateError, frames that cannot be
+    decoded are logged and dropped, neither stops the thread.
+    Events can also be pushed the other way, to the delegate of every connected emitter.
+    """
+
     def __init__(self):
-        self._client = None
+        self._clients = []
+        # Wire state of every client
+        self._decoders = {}
+        self._encoders = {}
+        # Answers and pushed events are sent from different threads
+        self._send_lock = Lock()
         self._queue = []
-        self._poll_interval = 0.001
-        self._update_interval = 0.001
-        self._time_since_last_update = 0
+        # Connections made since the last wait, handed to the dispatch thread through _wake
+        self._connected = []
+        self._lock = Lock()
+        self._wake_reader, self._wake_writer = Pipe(duplex=False)
+        self._thread = None
 
-    def connect(self, port: int):
-        self._client = Client(('localhost', port))
-        Thread(target=self._run, daemon=True).start()
+    def connect(self, port: int, authkey: Optional[bytes] = None):
+        """Connects to the emitter listening on port, retrying until it is listening"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+        Thread(target=self._connect, args=(port, authkey), daemon=True).start()
 
     def on_custom_event(self, code: str, event: str, data: Any) -> Any:
         pass
 
+    def push(self, event: str, data: Any = None):
+        """Sends the event to the delegate of every connected emitter (dropped when none is connected)"""
+        with self._send_lock:
+            for client in list(self._encoders):
+                try:
+                    client.send_bytes(self._encoders[client].frame(Kind.Requests, [(None, 'e', event, data)]))
+                except OSError:
+                    pass
+
+    def _connect(self, port: int, authkey: Optional[bytes]):
+        while True:
+            try:
+                client = Client(('localhost', port), authkey=authkey)
+                break
+            except ConnectionRefusedError:
+                time.sleep(Numbers.DelegateConnectInterval)
+            except (OSError, AuthenticationError) as e:
+                # e.g. another program listening on the port, nothing would ever answer its requests
+                _log.error('SocketDelegate could not connect to the emitter on port %d: %r', port, e)
+                return
+
+        _set_no_delay(client)
+        with self._lock:
+            self._connected.append(client)
+            self._wake_writer.send_bytes(b'')
+
     def _run(self):
         while True:
-            time.sleep(self._poll_interval)
-            self._time_since_last_update += self._poll_interval
-            self._read_events()
-            if self._time_since_last_update >= self._update_interval:
-                self._time_since_last_update = 0
-                self._update()
+            for ready in wait(self._clients + [self._wake_reader]):
+                if ready is self._wake_reader:
+                    self._add_clients()
+                else:
+                    self._read_events(ready)
+            # Everything that arrived while waiting or reading is dispatched in one pass
+            self._update()
 
-    def _read_events(self):
-        while self._client.poll():
-            self._queue.append(self._client.recv())
+    def _add_clients(self):
+        with self._lock:
+            while self._wake_reader.poll():
+                self._wake_reader.recv_bytes()
+            for client in self._connected:
+                self._clients.append(client)
+                self._decoders[client] = Decoder()
+                self._encoders[client] = Encoder()
+            self._connected.clear()
+
+    def _read_events(self, client: Connection):
+        decoder = self._decoders[client]
+        try:
+            while client.poll():
+                frame = client.recv_bytes()
+                try:
+                    _, messages = decoder.frame(frame)
+                except Exception:
+                    # e.g. an emitter of another wire version, the requests of the frame time out
+                    _log.exception('SocketDelegate dropped a frame it could not decode')
+                    continue
+                self._queue.extend((client, message) for message in messages)
+        except (EOFError, OSError):
+            # The emitter process exited
+            with self._send_lock:
+                self._clients.remove(client)
+                del self._decoders[client], self._encoders[client]
+                client.close()
 
     def _update(self):
-        for t, event, data in self._queue:
-            if t == 'c':
-                self._client.send(self.check_event(event, data))
-            elif t == 'e':
-                self.on_event(event, data)
-            else:
-                result = self.on_custom_event(t, event, data)
-                if result is not None:
-                    self._client.send(result)
+        answers = {}
+        for client, (request_id, code, event, data) in self._queue:
+            try:
+                if code == 'c':
+                    result = self.check_event(event, data)
+                elif code == 'e':
+                    self.on_event(event, data)
+                    continue
+                else:
+                    result = self.on_custom_event(code, event, data)
+            except Exception as e:
+                _log.exception('SocketDelegate failed to handle %s %s', code, event)
+                result = DelegateError('%s %s failed: %s: %s' % (code, event, type(e).__name__, e))
+
+            if request_id is not None:
+                answers.setdefault(client, []).append((request_id, result))
 
         self._queue.clear()
+        with self._send_lock:
+            for client, results in answers.items():
+                if client in self._encoders:
+                    try:
+                        client.send_bytes(self._encoders[client].frame(Kind.Answers, results))
+                    except OSError:
+                        pass
 
 
 class SocketEmitter(Emitter):
+    """
+    Sends events to a SocketDelegate in another process. Any number of threads can wait for
+    answers at once, requests are sent without waiting for earlier ones to be answered and
+    answers are matched to their request by id. Requests queued by other threads while a
+    frame is being sent go out together in the next frame. Events pushed by the SocketDelegate
+    are given to the delegate of the emitter, on the thread reading answers.
+    """
 
     def __init__(self):
         super().__init__()
         self._conn = None
         self._server = None
+        # Port listened on, picked by the OS when connecting to port 0
+        self.port = None
+        self._accepted = Event()
+        self._send_lock = Lock()
+        self._outgoing_lock = Lock()
+        self._outgoing = []
+        self._encoder = Encoder()
+        self._decoder = Decoder()
+        self._ids = count()
+        self._pending = {}
 
-    def connect(self, port: int):
-        self._server = Listener(('localhost', port))
+    def connect(self, port: int, authkey: Optional[bytes] = None):
+        self._server = Listener(('localhost', port), authkey=authkey)
+        self.port = self._server.address[1]
         Thread(target=self._connect, daemon=True).start()
 
     def wait_for_client(self):
-        while self._conn is None:
-            time.sleep(0.001)
+        self._accepted.wait()
+
+    def close(self):
+        if self._conn is not None:
+            # Shut down first, closing alone does not interrupt the thread reading answers
+            sock = socket.fromfd(self._conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+            self._conn.close()
+        self._server.close()
 
     def check_event(self, event: str, data: Any = None) -> int:
-        self._conn.send(('c', event, data))
-        return self._conn.recv()
+        return self.request('c', event, data)
 
     def on_event(self, event: str, data: Any = None):
-        self._conn.send(('e', event, data))
+        self._send((None, 'e', event, data))
+
+    def request(self, code: str, event: str = '', data: Any = None) -> Any:
+        """
+        Sends a request to the delegate and waits for its answer
+        :raise TimeoutError: when the delegate does not answer in Numbers.DelegateTimeout seconds
+        :raise DelegateError: when the delegate raised while answering
+        """
+        # Ids are sent as 32 bit integers
+        request_id = next(self._ids) % 2 ** 31
+        answer = self._pending[request_id] = Future()
+        try:
+            self._send((request_id, code, event, data))
+            return answer.result(Numbers.DelegateTimeout)
+        except FutureTimeoutError:
+            raise TimeoutError('No answer to %s %s' % (code, event)) from None
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _send(self, message: tuple):
+        with self._outgoing_lock:
+            self._outgoing.append(message)
+        # The thread holding the lock sends the messages of every thread waiting for it
+        with self._send_lock:
+            with self._outgoing_lock:
+                messages, self._outgoing = self._outgoing, []
+            if messages:
+                self._conn.send_bytes(self._encoder.frame(Kind.Requests, messages))
 
     def _connect(self):
-        self._conn = self._server.accept()
+        while True:
+            try:
+                conn = self._server.accept()
+                break
+            except AuthenticationError:
+                # Some other program connected, keep waiting for the delegate
+                _log.warning('SocketEmitter rejected a connection on port %d', self.port)
+        _set_no_delay(conn)
+        self._conn = conn
+        self._accepted.set()
+        try:
+            while True:
+                frame = self._conn.recv_bytes()
+                try:
+                    kind, messages = self._decoder.frame(frame)
+                except Exception:
+                    _log.exception('SocketEmitter dropped a frame it could not decode')
+                    continue
+                if kind == Kind.Requests:
+                    self._dispatch(messages)
+                    continue
+                for request_id, result in messages:
+                    answer = self._pending.get(request_id)
+                    if answer is None:
+                        continue
+                    if isinstance(result, DelegateError):
+                        answer.set_exception(result)
+                    else:
+                        answer.set_result(result)
+        except (EOFError, OSError):
+            # The delegate process exited, fail the requests waiting for it
+            for answer in list(self._pending.values()):
+                answer.set_exception(ConnectionError('Delegate disconnected'))
+
+    def _dispatch(self, messages: [tuple]):
+        # Pushed events must not stop the thread reading answers
+        for _, _, event, data in messages:
+            try:
+                on_event(self.delegate, event, data)
+            except Exception:
+                _log.exception('Delegate of SocketEmitter failed on %s', event)
+
+
+# region Detail
+
+_log = logging.getLogger(__name__)
+
+
+def _set_no_delay(connection: Connection):
+    """
+    Sends every message immediately. Otherwise a message sent right after another one waits
+    for the acknowledgement of the first (Nagle's algorithm), which the receiver delays by up to 40ms.
+    """
+    sock = socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.close()
+
+# endregion
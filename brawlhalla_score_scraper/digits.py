@@ -0,0 +1,158 @@
+import os
+from typing import Optional, Union
+
+from numpy import arange, asarray, flatnonzero, load, ndarray, savez, stack, zeros
+from PIL import Image
+
+from .constants import Numbers
+
+
+__all__ = [
+    'DigitRecognizer',
+    'build_templates',
+    'get_recognizer',
+    'set_recognizer',
+]
+
+
+class DigitRecognizer:
+    """
+    Reads the score area without tesseract. The six rows of numbers and the digits
+    in each row are segmented with ink projections, and every digit is classified by
+    normalized cross correlation against one template per digit (0-9).
+    """
+
+    def __init__(self, templates: ndarray):
+        # (10, glyph height * glyph width) zero mean, unit norm templates
+        self.templates = templates
+
+    # region Recognition
+
+    def recognize(self, image: Union[Image.Image, ndarray]) -> (int, int, int, int, int, int):
+        values = []
+        for row in DigitRecognizer.segment(DigitRecognizer.binarize(image)):
+            if not row:
+                continue
+            glyphs = stack([DigitRecognizer.normalize(glyph) for glyph in row])
+            digits = (glyphs @ self.templates.T).argmax(axis=1)
+            values.append(int(''.join(map(str, digits))))
+        return tuple(values)
+
+    @staticmethod
+    def binarize(image: Union[Image.Image, ndarray]) -> ndarray:
+        pixels = asarray(image)
+        if pixels.ndim == 3:
+            pixels = pixels[..., :3].mean(axis=2)
+        return pixels > Numbers.ScoreDigitWhiteThreshold
+
+    @staticmethod
+    def segment(mask: ndarray) -> [[ndarray]]:
+        """Splits the binarized score area into rows of digit masks"""
+        rows = []
+        for top, bottom in _runs(mask.any(axis=1)):
+            line = mask[top:bottom]
+            rows.append([line[:, left:right] for left, right in _runs(line.any(axis=0))])
+        return rows
+
+    @staticmethod
+    def normalize(glyph: ndarray) -> ndarray:
+        """Crops the glyph to its ink, samples it to the template size and scales it to zero mean, unit norm"""
+        ys, xs = flatnonzero(glyph.any(axis=1)), flatnonzero(glyph.any(axis=0))
+        glyph = glyph[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+
+        width, height = Numbers.ScoreDigitGlyphSize
+        rows = arange(height) * glyph.shape[0] // height
+        columns = arange(width) * glyph.shape[1] // width
+        vector = glyph[rows][:, columns].astype(float).flatten()
+
+        vector -= vector.mean()
+        norm = (vector ** 2).sum() ** 0.5
+        return vector / norm if norm else vector
+
+    # endregion
+
+    # region Templates
+
+    @staticmethod
+    def build(labelled: [(Union[Image.Image, ndarray], (int, int, int, int, int, int))]) -> 'DigitRecognizer':
+        """
+        Averages the glyphs of every digit found in score area crops with known values.
+        Rows whose glyph count does not match their value are skipped.
+        """
+        width, height = Numbers.ScoreDigitGlyphSize
+        sums = zeros((10, width * height))
+        counts = zeros(10)
+
+        for image, values in labelled:
+            rows = [row for row in DigitRecognizer.segment(DigitRecognizer.binarize(image)) if row]
+            if len(rows) != len(values):
+                continue
+            for row, value in zip(rows, values):
+                if len(row) != len(str(value)):
+                    continue
+                for glyph, digit in zip(row, map(int, str(value))):
+                    sums[digit] += DigitRecognizer.normalize(glyph)
+                    counts[digit] += 1
+
+        missing = [str(d) for d in range(10) if not counts[d]]
+        if missing:
+            raise ValueError('No samples for digit(s) %s' % ', '.join(missing))
+
+        templates = sums / counts[:, None]
+        templates -= templates.mean(axis=1, keepdims=True)
+        templates /= (templates ** 2).sum(axis=1, keepdims=True) ** 0.5
+        return DigitRecognizer(templates)
+
+    def save(self, path: str):
+        savez(path, templates=self.templates)
+
+    @staticmethod
+    def load(path: str) -> 'DigitRecognizer':
+        with load(path) as data:
+            return DigitRecognizer(data['templates'])
+
+    # endregion
+
+
+def build_templates(directory: str, path: str) -> DigitRecognizer:
+    """
+    Builds digit templates from score area crops saved as PNG files named after
+    their six values (e.g. '420_3_1_0_812_305.png') and saves them to path
+    """
+    labelled = []
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension.lower() != '.png':
+            continue
+        values = tuple(map(int, name.split('_')))
+        with Image.open(os.path.join(directory, filename)) as image:
+            labelled.append((image.convert('RGB'), values))
+
+    recognizer = DigitRecognizer.build(labelled)
+    recognizer.save(path)
+    return recognizer
+
+
+_recognizer = None
+
+
+def get_recognizer() -> Optional[DigitRecognizer]:
+    """Returns the digit recognizer selected in place of tesseract for score areas (None uses tesseract)"""
+    return _recognizer
+
+
+def set_recognizer(recognizer: Optional[DigitRecognizer]):
+    global _recognizer
+    _recognizer = recognizer
+
+
+# region Detail
+
+def _runs(mask: ndarray) -> [(int, int)]:
+    """(start, end) of every run of True values in a 1d mask"""
+    padded = zeros(len(mask) + 2, dtype=int)
+    padded[1:-1] = mask
+    edges = flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2], edges[1::2]))
+
+# endregion
@@ -0,0 +1,147 @@
+import os
+import re
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from numpy import array, concatenate, dtype, load, ndarray
+from numpy.lib import format as npy
+
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:
+    pyarrow = None
+
+
+__all__ = [
+    'Dtypes',
+    'ExportWriter',
+    'NpzExportWriter',
+    'ParquetExportWriter',
+    'get_export_writer',
+    'load_export',
+]
+
+
+# Structured array layout of every exported table (missing names are exported as '')
+Dtypes = {
+    'match': dtype([
+        ('ID', 'i8'), ('Mode', 'U16'), ('GameMode', 'U16'), ('Teams', '?'), ('PlayerCount', 'i1'),
+        ('FirstName', 'U64'), ('SecondName', 'U64'), ('ThirdName', 'U64'), ('FourthName', 'U64'),
+    ]),
+    'individual_match': dtype([
+        ('MatchID', 'i8'), ('PlayerName', 'U64'), ('Legend', 'U32'), ('Team', 'i1'), ('Rank', 'i1'),
+        ('Score', 'i4'), ('KOS', 'i4'), ('Falls', 'i4'), ('Accidents', 'i4'), ('DMG_Done', 'i4'), ('DMG_Taken', 'i4'),
+    ]),
+}
+
+
+class ExportWriter(ABC):
+    """
+    Destination of a match history export. Every chunk of matches is stored as its own
+    part named '<table>_<first match id>_<last match id>', so an export can be extended
+    by adding parts without rewriting the ones already written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @abstractmethod
+    def parts(self) -> [str]:
+        pass
+
+    @abstractmethod
+    def write(self, table: str, first: int, last: int, rows: [tuple]):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    def last_exported(self) -> Optional[int]:
+        """Id of the newest exported match (None if nothing was exported)"""
+        ids = [last for _, _, last in map(_parse_part, self.parts())]
+        return max(ids) if ids else None
+
+
+class NpzExportWriter(ExportWriter):
+    """Appends every part as a structured array member ('<part>.npy') of one NumPy archive"""
+
+    def parts(self) -> [str]:
+        if not os.path.exists(self.path):
+            return []
+        with zipfile.ZipFile(self.path) as archive:
+            return [name for name in archive.namelist() if _parse_part(name)]
+
+    def write(self, table: str, first: int, last: int, rows: [tuple]):
+        # Fastest deflate level, the fixed width strings are mostly padding and compress well anyway
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            with archive.open('%s_%d_%d.npy' % (table, first, last), 'w', force_zip64=True) as member:
+                npy.write_array(member, array(rows, dtype=Dtypes[table]), allow_pickle=False)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ParquetExportWriter(ExportWriter):
+    """Writes every part as its own Parquet file ('<part>.parquet') in a directory"""
+
+    def __init__(self, path: str):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is not installed')
+        super().__init__(path)
+
+    def parts(self) -> [str]:
+        if not os.path.isdir(self.path):
+            return []
+        return [name for name in os.listdir(self.path) if _parse_part(name)]
+
+    def write(self, table: str, first: int, last: int, rows: [tuple]):
+        os.makedirs(self.path, exist_ok=True)
+        columns = array(rows, dtype=Dtypes[table])
+        parquet.write_table(pyarrow.table({name: columns[name] for name in columns.dtype.names}),
+                            os.path.join(self.path, '%s_%d_%d.parquet' % (table, first, last)))
+
+    def clear(self):
+        for name in self.parts():
+            os.remove(os.path.join(self.path, name))
+
+
+def get_export_writer(path: str) -> ExportWriter:
+    """NumPy archive for paths ending in .npz, a directory of Parquet files otherwise"""
+    if path.lower().endswith('.npz'):
+        return NpzExportWriter(path)
+    return ParquetExportWriter(path)
+
+
+def load_export(path: str) -> {str: ndarray}:
+    """
+    Reads a NumPy archive export back into one structured array per table, in match order
+    (Parquet exports can be read directly with pyarrow.parquet.read_table)
+    """
+    tables = {table: [] for table in Dtypes}
+    with load(path) as archive:
+        for name in archive.files:
+            part = _parse_part(name)
+            if part:
+                table, first, _ = part
+                tables[table].append((first, archive[name]))
+
+    return {table: concatenate([rows for _, rows in sorted(parts, key=lambda p: p[0])])
+            if parts else array([], dtype=Dtypes[table])
+            for table, parts in tables.items()}
+
+
+# region Detail
+
+_part = re.compile(r'^(%s)_(\d+)_(\d+)(?:\.npy|\.parquet)?$' % '|'.join(Dtypes))
+
+
+def _parse_part(name: str) -> Optional[tuple]:
+    """(table, first match id, last match id) of a part name"""
+    match = _part.match(name)
+    return match and (match.group(1), int(match.group(2)), int(match.group(3)))
+
+# endregion
@@ -0,0 +1,150 @@
+from typing import Iterable, Optional
+
+from .constants import Numbers
+
+
+__all__ = [
+    'BKTree',
+    'edit_distance',
+    'edit_budget',
+    'closest',
+]
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Levenshtein distance between two strings, computed with the bit-parallel
+    algorithm of Myers / Hyyrö (one pass over b, columns of a held in an int)
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+
+    # Bit i of masks[c] is set if a[i] == c
+    masks = {}
+    for i, c in enumerate(a):
+        masks[c] = masks.get(c, 0) | (1 << i)
+
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    positive, negative, distance = full, 0, len(a)
+
+    for c in b:
+        match = masks.get(c, 0)
+        vertical = match | negative
+        horizontal = (((match & positive) + positive) ^ positive) | match
+        horizontal_positive = negative | (~(horizontal | positive) & full)
+        horizontal_negative = positive & horizontal
+
+        if horizontal_positive & last:
+            distance += 1
+        elif horizontal_negative & last:
+            distance -= 1
+
+        horizontal_positive = ((horizontal_positive << 1) | 1) & full
+        horizontal_negative = (horizontal_negative << 1) & full
+        positive = horizontal_negative | (~(vertical | horizontal_positive) & full)
+        negative = horizontal_positive & vertical
+
+    return distance
+
+
+def edit_budget(word: str, max_distance: int) -> int:
+    """Edits allowed to correct word, at most max_distance and fewer for short words (none for empty ones)"""
+    return min(max_distance, len(word) // Numbers.CharactersPerEdit)
+
+
+def closest(word: str, vocabulary: Iterable[str], max_distance: int) -> Optional[str]:
+    """
+    Word of the vocabulary with the smallest edit distance to word, if it is within max_distance.
+    None when several words share the smallest distance, word is as close to each of them.
+    """
+    best, best_distance, tied = None, max_distance + 1, False
+    for candidate in sorted(vocabulary):
+        distance = edit_distance(word, candidate)
+        if distance < best_distance:
+            best, best_distance, tied = candidate, distance, False
+        elif distance == best_distance:
+            tied = True
+    return None if tied else best
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over words with edit distance as the metric. Finding the
+    closest word within a small distance only visits the branches that can contain it.
+    Removed words are hidden until enough of them accumulate to rebuild the tree.
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._root = None
+        self._words = set()
+        self._removed = set()
+        for word in words:
+            self.add(word)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._words
+
+    def __len__(self):
+        return len(self._words)
+
+    def add(self, word: str):
+        if word in self._words:
+            return
+        self._words.add(word)
+
+        if word in self._removed:
+            self._removed.discard(word)
+            return
+
+        if self._root is None:
+            self._root = (word, {})
+            return
+
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def remove(self, word: str):
+        if word not in self._words:
+            return
+        self._words.discard(word)
+        self._removed.add(word)
+
+        if len(self._removed) > len(self._words):
+            words, self._root, self._words, self._removed = self._words, None, set(), set()
+            for w in words:
+                self.add(w)
+
+    def closest(self, word: str, max_distance: int) -> Optional[str]:
+        """
+        Word in the tree with the smallest edit distance to word, if it is within max_distance.
+        None when several words share the smallest distance, whatever order they were added in.
+        """
+        if word in self._words:
+            return word
+
+        best, best_distance, tied = None, max_distance + 1, False
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            candidate, children = nodes.pop()
+            distance = edit_distance(word, candidate)
+            if candidate not in self._removed:
+                if distance < best_distance:
+                    best, best_distance, tied = candidate, distance, False
+                elif distance == best_distance:
+                    tied = True
+
+            # Triangle inequality: only children within best_distance of this distance can be as close
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= best_distance:
+                    nodes.append(child)
+
+        return None if tied else best
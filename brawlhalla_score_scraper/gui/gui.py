@@ -21,7 +21,7 @@ class GUI(Runnable, Delegate):
         self.queue = ConsoleCommandQueue()
         self.app = Application(self.db, self.queue) if not only_client else ClientApplication()
 
-        self.app.scraper.players.connect(self)
+        self.app.player_events.add(self)
 
     def run(self):
         self.app.run()
@@ -44,6 +44,21 @@ class GUI(Runnable, Delegate):
                 or event == Events.Player.UpdatedLivePlayers:
             print(data)
 
+        elif event == Events.Database.Written:
+            operation, argument, result = data
+            if operation == 'export' and result is not False:
+                print('Exported %d matches to %s' % (result, argument))
+
+            elif operation == 'import_matches' and result is not False:
+                imported, rejected = result
+                print('Imported %d matches from %s, %d results rejected' % (imported, argument, len(rejected)))
+                for line, reason in rejected:
+                    print('  line %s: %s' % (line, reason))
+
+        elif event == Events.Database.Failed:
+            operation, argument, error = data
+            print('%s %s failed: %s' % (operation, argument, error))
+
     # endregion
 
 # endregion
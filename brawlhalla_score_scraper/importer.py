@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator
+
+from .constants import Legends
+
+
+__all__ = [
+    'Columns',
+    'read_results',
+    'read_matches',
+    'validate_match',
+]
+
+
+# Columns of an individual result in CSV/JSON history files (Team, KOS, Falls, Accidents and DMG_* may be left out)
+Columns = ('Match', 'PlayerName', 'Legend', 'Team', 'Rank', 'Score',
+           'KOS', 'Falls', 'Accidents', 'DMG_Done', 'DMG_Taken')
+
+
+def read_results(path: str) -> Iterator[tuple]:
+    """
+    Reads individual results from a CSV file with a header row or a JSON list of objects,
+    both using Columns as field names. Values are not converted or validated.
+    :return: (line or list index, *Columns) of every result, missing values are None
+    """
+    if os.path.splitext(path)[1].lower() == '.json':
+        with open(path) as f:
+            for index, result in enumerate(json.load(f)):
+                yield (index,) + tuple(result.get(column) for column in Columns)
+        return
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        width = len(header)
+        # Missing columns read the None appended to every row
+        values = itemgetter(*(header.index(column) if column in header else width for column in Columns))
+        # Data starts on the second line, after the header
+        for line, row in enumerate(reader, 2):
+            if len(row) != width:
+                row = (row + [None] * width)[:width]
+            row.append(None)
+            yield (line,) + values(row)
+
+
+def read_matches(path: str) -> Iterator[list]:
+    """Results of read_results grouped by their Match value, results of one match must be consecutive"""
+    for _, results in groupby(read_results(path), key=itemgetter(1)):
+        yield list(results)
+
+
+def validate_match(results: [tuple], players: {str}, accounts: {str}) -> ([tuple], [(int, str)]):
+    """
+    Converts the results of one match to (player name, legend, team, rank, score, kos, falls,
+    accidents, dmg done, dmg taken) tuples sorted by rank
+    :return: the converted results and no errors, or no results and (line, reason) of every invalid result
+    """
+    converted, errors = [], []
+    legends = Legends.all
+    for line, _, name, legend, *values in results:
+        name, legend = str(name or '').strip(), str(legend or '').strip().upper()
+        if name not in players:
+            reason = 'is an account, not a player' if name in accounts else 'is not a registered player'
+            errors.append((line, '%s %s' % (name or 'missing player', reason)))
+        elif legend not in legends:
+            errors.append((line, 'unknown legend %s' % (legend or 'missing')))
+        elif values[1] in _missing or values[2] in _missing:
+            errors.append((line, 'missing rank or score'))
+        else:
+            try:
+                converted.append((name, legend) + _ints(values))
+            except ValueError as e:
+                errors.append((line, str(e)))
+
+    if errors:
+        return [], errors
+    if len({result[0] for result in converted}) != len(converted):
+        return [], [(results[0][0], 'player listed twice in match %s' % results[0][1])]
+    if len(converted) > 4:
+        return [], [(results[0][0], 'more than 4 players in match %s' % results[0][1])]
+
+    return sorted(converted, key=itemgetter(3)), []
+
+
+# region Detail
+
+_missing = (None, '')
+
+
+def _ints(values: list) -> tuple:
+    """Converts the values to int, missing values are 0"""
+    try:
+        return tuple(map(int, values))
+    except (TypeError, ValueError):
+        return tuple(int(value) if value not in _missing else 0 for value in values)
+
+# endregion
@@ -0,0 +1,134 @@
+import os
+from typing import Optional, Union
+
+from numpy import arange, array, asarray, flatnonzero, load, ndarray, savez, stack, zeros
+from PIL import Image, ImageDraw, ImageFont
+
+from .constants import Legends, Numbers, Size, Sizes
+
+
+__all__ = [
+    'LegendClassifier',
+    'build_templates',
+    'get_classifier',
+    'set_classifier',
+]
+
+
+class LegendClassifier:
+    """
+    Matches name label crops against a precomputed index holding one template per legend.
+    Every crop is compared with all legends at once by normalized cross correlation.
+    """
+
+    def __init__(self, legends: [str], templates: ndarray):
+        self.legends = list(legends)
+        # (legend count, template height * template width) zero mean, unit norm templates
+        self.templates = templates
+
+    def classify(self, image: Union[Image.Image, ndarray]) -> (str, float):
+        """:return: the best matching legend and its correlation (1.0 is a perfect match)"""
+        return self.classify_all([image])[0]
+
+    def classify_all(self, images: [Union[Image.Image, ndarray]]) -> [(str, float)]:
+        scores = stack([LegendClassifier.vectorize(image) for image in images]) @ self.templates.T
+        best = scores.argmax(axis=1)
+        return [(self.legends[i], float(scores[n, i])) for n, i in enumerate(best)]
+
+    @staticmethod
+    def vectorize(image: Union[Image.Image, ndarray]) -> ndarray:
+        """Crops the thresholded label to its text, samples it to the template size and normalizes it"""
+        pixels = asarray(image)
+        if pixels.ndim == 3:
+            pixels = pixels[..., :3].mean(axis=2)
+        mask = pixels > Numbers.NameLabelWhiteThreshold
+
+        width, height = Numbers.LegendTemplateSize
+        ys, xs = flatnonzero(mask.any(axis=1)), flatnonzero(mask.any(axis=0))
+        if not len(ys):
+            return zeros(width * height)
+        mask = mask[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+
+        rows = arange(height) * mask.shape[0] // height
+        columns = arange(width) * mask.shape[1] // width
+        vector = mask[rows][:, columns].astype(float).flatten()
+
+        vector -= vector.mean()
+        norm = (vector ** 2).sum() ** 0.5
+        return vector / norm if norm else vector
+
+    # region Index
+
+    @staticmethod
+    def build(labelled: [(Union[Image.Image, ndarray], str)]) -> 'LegendClassifier':
+        """Averages the labels of every legend from name label crops with known legends"""
+        samples = {}
+        for image, legend in labelled:
+            if Legends.exists(legend):
+                samples.setdefault(legend, []).append(LegendClassifier.vectorize(image))
+        legends = sorted(samples)
+        return LegendClassifier(legends, _normalized(array([sum(samples[l]) / len(samples[l]) for l in legends])))
+
+    @staticmethod
+    def render(font: str, size: Size = Sizes.NameLabel) -> 'LegendClassifier':
+        """Renders the label of every legend with the given TrueType font"""
+        legends = sorted(Legends.all)
+        typeface = ImageFont.truetype(font, size.height - 10)
+        images = []
+        for legend in legends:
+            image = Image.new('L', size, 0)
+            ImageDraw.Draw(image).text((4, 4), legend, fill=255, font=typeface)
+            images.append(image)
+        return LegendClassifier(legends, stack([LegendClassifier.vectorize(image) for image in images]))
+
+    def save(self, path: str):
+        savez(path, legends=array(self.legends), templates=self.templates)
+
+    @staticmethod
+    def load(path: str) -> 'LegendClassifier':
+        with load(path) as data:
+            return LegendClassifier([str(l) for l in data['legends']], data['templates'])
+
+    # endregion
+
+
+def build_templates(directory: str, path: str) -> LegendClassifier:
+    """
+    Builds legend templates from name label crops saved as PNG files named after
+    their legend (e.g. 'PETRA.png' or 'PETRA_2.png') and saves them to path
+    """
+    labelled = []
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension.lower() != '.png':
+            continue
+        with Image.open(os.path.join(directory, filename)) as image:
+            labelled.append((image.convert('RGB'), name.split('_')[0].upper()))
+
+    classifier = LegendClassifier.build(labelled)
+    classifier.save(path)
+    return classifier
+
+
+_classifier = None
+
+
+def get_classifier() -> Optional[LegendClassifier]:
+    """Returns the legend classifier used before OCR for name labels (None always uses OCR)"""
+    return _classifier
+
+
+def set_classifier(classifier: Optional[LegendClassifier]):
+    global _classifier
+    _classifier = classifier
+
+
+# region Detail
+
+def _normalized(templates: ndarray) -> ndarray:
+    templates = templates - templates.mean(axis=1, keepdims=True)
+    norms = (templates ** 2).sum(axis=1, keepdims=True) ** 0.5
+    norms[norms == 0] = 1
+    return templates / norms
+
+# endregion
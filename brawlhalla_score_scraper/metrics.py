@@ -0,0 +1,163 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Optional
+
+
+__all__ = [
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Registry',
+    'registry',
+]
+
+
+class Metric:
+    kind: str = 'untyped'
+
+    def __init__(self, registry: 'Registry', name: str, labels: {str: str}):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def render(self) -> [str]:
+        pass
+
+    def _series(self, suffix: str = '', extra: {str: str} = None) -> str:
+        labels = dict(self.labels, **(extra or {}))
+        if not labels:
+            return self.name + suffix
+        return '%s%s{%s}' % (self.name, suffix, ','.join('%s="%s"' % kv for kv in labels.items()))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, registry: 'Registry', name: str, labels: {str: str}):
+        super().__init__(registry, name, labels)
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        if self.registry.enabled:
+            self.value += amount
+
+    def render(self) -> [str]:
+        return ['%s %s' % (self._series(), self.value)]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, registry: 'Registry', name: str, labels: {str: str}, function: Optional[Callable] = None):
+        super().__init__(registry, name, labels)
+        self.value = 0
+        # Evaluated when rendering instead of holding a value
+        self.function = function
+
+    def set(self, value: float):
+        if self.registry.enabled:
+            self.value = value
+
+    def render(self) -> [str]:
+        return ['%s %s' % (self._series(), self.function() if self.function else self.value)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    DefaultBuckets = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, registry: 'Registry', name: str, labels: {str: str}, buckets: (float,) = DefaultBuckets):
+        super().__init__(registry, name, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if self.registry.enabled:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> '_Timer':
+        """Context manager observing the time spent in its block"""
+        return _Timer(self)
+
+    def timed(self, f: Callable) -> Callable:
+        """Decorator observing the time spent in every call"""
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            with _Timer(self):
+                return f(*args, **kwargs)
+        return wrapped
+
+    def render(self) -> [str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s %d' % (self._series('_bucket', {'le': le}), cumulative))
+        lines.append('%s %r' % (self._series('_sum'), self.sum))
+        lines.append('%s %d' % (self._series('_count'), self.count))
+        return lines
+
+
+class Registry:
+    """
+    Process wide collection of metrics, rendered in the Prometheus text exposition format.
+    When disabled every update is a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._help = {}
+
+    def counter(self, name: str, help_: str, **labels) -> Counter:
+        return self._get(Counter, name, help_, labels)
+
+    def gauge(self, name: str, help_: str, function: Optional[Callable] = None, **labels) -> Gauge:
+        gauge = self._get(Gauge, name, help_, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name: str, help_: str, **labels) -> Histogram:
+        return self._get(Histogram, name, help_, labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._metrics.items():
+            lines.append('# HELP %s %s' % (name, self._help[name]))
+            lines.append('# TYPE %s %s' % (name, series[0].kind))
+            for metric in series:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, cls, name: str, help_: str, labels: {str: str}):
+        series = self._metrics.setdefault(name, [])
+        self._help.setdefault(name, help_)
+        for metric in series:
+            if metric.labels == labels:
+                return metric
+        metric = cls(self, name, labels)
+        series.append(metric)
+        return metric
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+registry = Registry()
@@ -8,6 +8,7 @@ __all__ = [
     'IndividualMatch',
     'LivePlayer',
     'Score',
+    'Stats',
     'Nobody'
 ]
 
@@ -114,4 +115,37 @@ class Score:
                 self.accidents, self.dmg_done, self.dmg_taken)
 
 
+class Stats(Model):
+    """Totals over every match of a player, a legend or a player with a legend (the other key is None)"""
+
+    def __init__(self,
+                 player_name: Optional[str],
+                 legend: Optional[str],
+                 matches: int,
+                 wins: int,
+                 score: int,
+                 kos: int,
+                 falls: int,
+                 accidents: int,
+                 dmg_done: int,
+                 dmg_taken: int):
+        self.player_name = player_name
+        self.legend = legend
+        self.matches = matches
+        self.wins = wins
+        self.score = score
+        self.kos = kos
+        self.falls = falls
+        self.accidents = accidents
+        self.dmg_done = dmg_done
+        self.dmg_taken = dmg_taken
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.matches if self.matches else 0.0
+
+    def __repr__(self):
+        return "Stats(%s, %s, matches: %d, wins: %d)" % (self.player_name, self.legend, self.matches, self.wins)
+
+
 Nobody = Player('', '', Color(0, 0, 0))
@@ -0,0 +1,339 @@
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Callable, Optional
+
+import pytesseract
+from numpy import asarray, int16
+from PIL import Image
+
+from .constants import Numbers
+from .metrics import registry
+
+try:
+    import tesserocr
+    from tesserocr import RIL, iterate_level
+except ImportError:
+    tesserocr = None
+
+
+__all__ = [
+    'OCREngine',
+    'PytesseractEngine',
+    'TesserocrEngine',
+    'Mosaic',
+    'OCRPool',
+    'OCRCache',
+    'get_engine',
+    'set_engine',
+    'get_cache',
+    'set_cache',
+]
+
+
+# Language data used by the scraper, loaded once by resident engines
+Languages = ('eng', 'numbers')
+
+
+class OCREngine(ABC):
+
+    @abstractmethod
+    def image_to_string(self, image: Image.Image, lang: str, psm: int) -> str:
+        pass
+
+    @abstractmethod
+    def image_to_lines(self, image: Image.Image, lang: str, psm: int) -> [(int, int, str)]:
+        """
+        Recognizes every line of text in the image
+        :return: (top, bottom, text) of each line, in reading order
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class PytesseractEngine(OCREngine):
+    """
+    Runs the tesseract executable for every image (one process and a few temp files per call).
+    """
+
+    def image_to_string(self, image: Image.Image, lang: str, psm: int) -> str:
+        prefix = '-' if sys.platform in {'win32', 'cygwin'} else ''
+        return pytesseract.image_to_string(image, lang=lang, config=prefix + '-psm %d' % psm)
+
+    def image_to_lines(self, image: Image.Image, lang: str, psm: int) -> [(int, int, str)]:
+        prefix = '-' if sys.platform in {'win32', 'cygwin'} else ''
+        data = pytesseract.image_to_data(image, lang=lang, config=prefix + '-psm %d' % psm,
+                                         output_type=pytesseract.Output.DICT)
+
+        # Words are reported individually, group them by the line they belong to
+        lines = {}
+        for i, word in enumerate(data['text']):
+            if not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            top, bottom = data['top'][i], data['top'][i] + data['height'][i]
+            if key in lines:
+                line_top, line_bottom, words = lines[key]
+                lines[key] = (min(top, line_top), max(bottom, line_bottom), words + [word])
+            else:
+                lines[key] = (top, bottom, [word])
+
+        return [(top, bottom, ' '.join(words)) for top, bottom, words in lines.values()]
+
+
+class TesserocrEngine(OCREngine):
+    """
+    Keeps one in-process tesseract API per language resident, so language data
+    is loaded once and every recognition is a plain function call.
+    """
+
+    def __init__(self, languages: (str,) = Languages, path: Optional[str] = None):
+        if tesserocr is None:
+            raise RuntimeError('tesserocr is not installed')
+
+        kwargs = {} if path is None else {'path': path}
+        self._apis = {}
+        self._lock = Lock()
+        try:
+            for lang in languages:
+                self._apis[lang] = tesserocr.PyTessBaseAPI(lang=lang, **kwargs)
+        except RuntimeError:
+            self.close()
+            raise
+
+    def image_to_string(self, image: Image.Image, lang: str, psm: int) -> str:
+        api = self._apis[lang]
+        with self._lock:
+            api.SetPageSegMode(psm)
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+    def image_to_lines(self, image: Image.Image, lang: str, psm: int) -> [(int, int, str)]:
+        api = self._apis[lang]
+        with self._lock:
+            api.SetPageSegMode(psm)
+            api.SetImage(image)
+            api.Recognize()
+            lines = []
+            for line in iterate_level(api.GetIterator(), RIL.TEXTLINE):
+                text = line.GetUTF8Text(RIL.TEXTLINE)
+                box = line.BoundingBox(RIL.TEXTLINE)
+                if text and box:
+                    lines.append((box[1], box[3], text.strip()))
+            return lines
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+class Mosaic:
+    """
+    Stacks several crops vertically, separated by bands of background, so they
+    can be recognized with one OCR call. Lines of text found in the mosaic are
+    split back to the crop they were read from using the known tile positions.
+    """
+
+    def __init__(self, images: [Image.Image], separator: int, background=None):
+        self.separator = separator
+        self.tiles = []
+
+        width = max(image.width for image in images) + 2 * separator
+        height = sum(image.height for image in images) + (len(images) + 1) * separator
+        if background is None:
+            background = images[0].getpixel((0, 0))
+
+        self.image = Image.new(images[0].mode, (width, height), background)
+
+        top = separator
+        for image in images:
+            self.image.paste(image, (separator, top))
+            self.tiles.append((top, top + image.height))
+            top += image.height + separator
+
+    def split(self, lines: [(int, int, str)]) -> [[str]]:
+        texts = [[] for _ in self.tiles]
+        margin = self.separator / 2
+        for top, bottom, text in sorted(lines):
+            center = (top + bottom) / 2
+            for i, (tile_top, tile_bottom) in enumerate(self.tiles):
+                if tile_top - margin <= center < tile_bottom + margin:
+                    texts[i].append(text)
+                    break
+        return texts
+
+    def recognize(self, engine: 'OCREngine', lang: str, psm: int) -> [[str]]:
+        return self.split(engine.image_to_lines(self.image, lang, psm))
+
+
+class OCRPool:
+    """
+    Process pool for running OCR of independent crops concurrently.
+    Every worker loads its own engine when it starts and stays alive between scoreboards.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def warm(self):
+        # Make the pool start every worker (and load its language data) before the first scoreboard
+        list(self._executor.map(_worker_pid, range(self.workers)))
+
+    def map(self, f: Callable, *iterables) -> list:
+        """Applies f to every item concurrently, results are returned in the order of the items"""
+        return list(self._executor.map(f, *iterables))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def _init_worker():
+    get_engine()
+
+
+def _worker_pid(_) -> int:
+    return os.getpid()
+
+
+class OCRCache:
+    """
+    Bounded LRU cache of OCR results keyed by a perceptual hash (dHash) of the preprocessed crop.
+    A crop whose hash is within `tolerance` differing bits of a cached one reuses its text
+    (see Numbers.OCRCacheTolerance, only equal hashes by default).
+    Every entry counts the OCR reads that agreed on its text and is only used once `confirmations`
+    reads agreed, a read of the same crop disagreeing with it replaces it. Empty text is never cached.
+    """
+
+    # Version of the saved file, files of other versions are ignored (bumped when preprocessing changes)
+    Version: int = 1
+
+    def __init__(self, size: int = Numbers.OCRCacheSize, tolerance: int = Numbers.OCRCacheTolerance,
+                 confirmations: int = Numbers.OCRCacheConfirmations):
+        self.size = size
+        self.tolerance = tolerance
+        self.confirmations = confirmations
+        self.hits = 0
+        self.misses = 0
+        # key -> [text, agreeing reads]
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def hash(image: Image.Image) -> int:
+        width, height = Numbers.OCRCacheHashSize
+        pixels = asarray(image.convert('L').resize((width + 1, height), Image.BILINEAR), dtype=int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return int(''.join('1' if b else '0' for b in bits), 2)
+
+    def get(self, key: int) -> Optional[str]:
+        key = self._find(key)
+        if key is None or self._entries[key][1] < self.confirmations:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key: int, text: str, reads: int = 1):
+        """Adds an OCR read of the crop with hash key"""
+        if not text.strip():
+            return
+
+        # Agreeing reads of a similar crop count for its entry, other labels may have a similar hash
+        found = self._find(key)
+        if found is not None and self._entries[found][0] == text:
+            key = found
+            reads += self._entries[found][1]
+        self._entries[key] = [text, reads]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'version': OCRCache.Version,
+                       'entries': [['%x' % key, text, reads] for key, (text, reads) in self._entries.items()]}, f)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            saved = json.load(f)
+        # Older files (a plain list) kept every read, including misreads
+        if not isinstance(saved, dict) or saved.get('version') != OCRCache.Version:
+            return
+        for key, text, reads in saved['entries']:
+            self.put(int(key, 16), text, reads)
+
+    def _find(self, key: int) -> Optional[int]:
+        """The key of the entry for the crop with hash key, None when there is none"""
+        if key in self._entries:
+            return key
+        if self.tolerance <= 0:
+            return None
+        best, best_distance = None, self.tolerance + 1
+        for other in self._entries:
+            distance = bin(key ^ other).count('1')
+            if distance < best_distance:
+                best, best_distance = other, distance
+        return best
+
+
+_engine = None
+_cache = None
+
+
+def get_engine() -> OCREngine:
+    """
+    Returns the process wide OCR engine, creating it on first use.
+    The in-process engine is preferred and pytesseract is used when tesserocr
+    or its language data is not available.
+    """
+    global _engine
+    if _engine is None:
+        try:
+            _engine = TesserocrEngine()
+        except RuntimeError:
+            _engine = PytesseractEngine()
+    return _engine
+
+
+def set_engine(engine: Optional[OCREngine]):
+    global _engine
+    if _engine is not None and _engine is not engine:
+        _engine.close()
+    _engine = engine
+
+
+def get_cache() -> OCRCache:
+    """Returns the process wide cache of name and account label OCR results"""
+    global _cache
+    if _cache is None:
+        _cache = OCRCache()
+    return _cache
+
+
+def set_cache(cache: Optional[OCRCache]):
+    global _cache
+    _cache = cache
+
+
+registry.gauge('ocr_cache_hit_ratio', 'Share of name and account labels read from the OCR cache',
+               function=lambda: get_cache().hit_rate)
+registry.gauge('ocr_cache_entries', 'Labels held in the OCR cache', function=lambda: len(get_cache()))
@@ -1,10 +1,13 @@
-import time
-from collections import defaultdict
+from collections import defaultdict, deque
+from typing import Any, Optional
 
-from .constants import Events, Runnable
+from .constants import Events, Numbers, Runnable
 from .models import Player, LivePlayer, Score, Nobody
-from .database import Database
-from .delegate import Emitter, on_event
+from .database import DatabaseWriter
+from .delegate import Delegate, Emitter, on_event
+from .fuzzy import BKTree, edit_budget
+from .metrics import registry
+from .ocr import OCRPool
 from .screen import *
 
 
@@ -16,19 +19,45 @@ waiting_for_scores = 1 << 10
 waiting_for_names = 1 << 11
 waiting_for_new_game = 1 << 12
 
+_state_names = {
+    waiting_for_scores: 'waiting_for_scores',
+    waiting_for_names: 'waiting_for_names',
+    waiting_for_new_game: 'waiting_for_new_game',
+}
+
+_ticks = registry.counter('scraper_ticks_total', 'Iterations of the scraper loop')
+_unchanged = registry.counter('scraper_unchanged_frames_total', 'Ticks not probed because the screen did not change')
+_probe_seconds = registry.histogram('scraper_probe_seconds', 'Time spent matching the screen state probes')
+_scoreboards = registry.counter('scraper_scoreboards_total', 'Scoreboards read')
+_matches = registry.counter('scraper_matches_total', 'Matches saved to the database')
+_paused = registry.gauge('scraper_paused', 'Whether the scraper is paused')
+_states = {state: registry.gauge('scraper_state', 'Current state of the scraper (1 for the active state)', state=name)
+           for state, name in _state_names.items()}
+
 
 # TODO: Refactor Scores data model
 
-class ScoreScraper(Runnable):
+class ScoreScraper(Runnable, Delegate):
 
-    def __init__(self, db: Database):
+    def __init__(self, writer: DatabaseWriter):
         self.update_interval = 0.25
-        self.db = db
+        self.schedules = {
+            waiting_for_scores: PollSchedule(*Numbers.ScoresPollIntervals),
+            waiting_for_new_game: PollSchedule(*Numbers.NewGamePollIntervals),
+        }
+        self.gate = FrameGate()
+        self.batched_ocr = True
+        self.ocr_workers = Numbers.OCRWorkers
+        self.writer = writer
+        self.writer.connect(self)
         self.players = PlayerCache()
-        self.state = waiting_for_scores
+        self.state = None
+        self._set_state(waiting_for_scores)
         self.paused = False
         self.running = True
         self.queue = []
+        # Completed database writes, applied to the player cache on the scraper thread
+        self.written = deque()
 
     def add_account(self, account: str):
         if account in self.players.accounts:
@@ -71,64 +100,175 @@ class ScoreScraper(Runnable):
 
     def run(self):
 
-        while self.running:
+        pool = OCRPool(self.ocr_workers) if self.ocr_workers > 0 else None
+        if pool is not None:
+            pool.warm()
+
+        try:
+            self._run(pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def _run(self, pool: Optional[OCRPool]):
+
+        probe = get_screen_probe()
+        self.gate.points = probe.points
+        source = get_frame_source()
+
+        while self.running and not source.exhausted:
             try:
-                time.sleep(self.update_interval)
+                schedule = self.schedules.get(self.state)
+                source.sleep(self.update_interval if self.paused or schedule is None else schedule.interval)
 
                 self._process_queues()
 
+                _ticks.inc()
+                _paused.set(int(self.paused))
+
                 if self.paused:
                     continue
 
                 elif self.state == waiting_for_scores:
-                    if is_on_scores_screen():
-                        self.players.add_scores(get_scores_from_screen())
-                        self.state = waiting_for_names
+                    # Only probe when the screen changed since the last probe
+                    frame = grab_frame(probe.region)
+                    difference = self.gate.difference(frame)
+                    schedule.update(difference)
+                    if difference < self.gate.threshold:
+                        _unchanged.inc()
+                        continue
+
+                    with _probe_seconds.time():
+                        result = probe.probe(frame)
+                    if result.on_scores_screen:
+                        self.players.add_scores(get_scores_from_screen(
+                            offsets=result.offsets, batched=self.batched_ocr, pool=pool))
+                        _scoreboards.inc()
+                        self._set_state(waiting_for_names)
+                        # Usually every account is known, commit without waiting for the next tick
+                        self._commit_scores()
 
                 elif self.state == waiting_for_names:
-                    if self.players.has_player_for_each_legend_and_score():
-                        scores = self.players.get_scores()
-                        if self.db.add_scores(scores):
-                            on_event(self.players.delegate, Events.Player.NewScores, scores)
-                        self.state = waiting_for_new_game
+                    self._commit_scores()
 
                 elif self.state == waiting_for_new_game:
-                    if is_on_character_select_screen():
-                        self.state = waiting_for_scores
+                    frame = grab_frame(probe.region)
+                    difference = self.gate.difference(frame)
+                    schedule.update(difference)
+                    if difference < self.gate.threshold:
+                        _unchanged.inc()
+                        continue
+
+                    with _probe_seconds.time():
+                        result = probe.probe(frame)
+                    if not result.on_scores_screen:
+                        self.schedules[waiting_for_scores].reset()
+                        self._set_state(waiting_for_scores)
 
             except KeyboardInterrupt:
                 break
 
+    def _commit_scores(self):
+        if self.players.has_player_for_each_legend_and_score():
+            # Committed by the writer thread, NewScores is sent once it has been saved
+            self.writer.add_scores(self.players.get_scores())
+            self._set_state(waiting_for_new_game)
+
+    def _set_state(self, state: int):
+        if self.state in _states:
+            _states[self.state].set(0)
+        _states[state].set(1)
+        self.state = state
+
+    def on_event(self, event: str, data: Any = None):
+
+        if event == Events.Database.Written:
+            operation, written, result = data
+            if operation == 'add_scores':
+                if result:
+                    _matches.inc()
+                    on_event(self.players.delegate, Events.Player.NewScores, written)
+            elif operation in ('export', 'import_matches'):
+                # Outcome of a console command, shown by the delegate of the players
+                on_event(self.players.delegate, event, data)
+            else:
+                self.written.append(data)
+
+        elif event == Events.Database.Failed:
+            on_event(self.players.delegate, event, data)
+
     def _process_queues(self):
         for command, data in self.queue:
 
             if command == Events.Command.AddAccount:
-                if self.db.add_account(data):
-                    self.players.add_account(data)
+                self.writer.add_account(data)
 
             elif command == Events.Command.RemoveAccount:
-                if self.db.remove_account(data):
-                    self.players.remove_account(data)
+                self.writer.remove_account(data)
 
             elif command == Events.Command.AddPlayer:
-                if self.db.add_player(data):
-                    self.players.add_player(data)
+                self.writer.add_player(data)
 
             elif command == Events.Command.RemovePlayer:
-                if self.db.remove_player(data):
-                    self.players.remove_player(data)
+                self.writer.remove_player(data)
 
         self.queue.clear()
 
+        while self.written:
+            operation, data, result = self.written.popleft()
+            if not result:
+                continue
+
+            if operation == 'add_account':
+                self.players.add_account(data)
+
+            elif operation == 'remove_account':
+                self.players.remove_account(data)
+
+            elif operation == 'add_player':
+                self.players.add_player(data)
+
+            elif operation == 'remove_player':
+                self.players.remove_player(data)
+
 
 # region Detail
 
+class PollSchedule:
+    """
+    Polling interval of one scraper state. It drops to the fastest interval when the screen
+    transitions (e.g. at match end), settles at the gameplay interval while the screen
+    moves, and backs off to the slowest interval while the screen is static.
+    """
+
+    def __init__(self, fastest: float, gameplay: float, static: float, backoff: float = Numbers.PollBackoff):
+        self.fastest = fastest
+        self.gameplay = gameplay
+        self.static = static
+        self.backoff = backoff
+        self.interval = fastest
+
+    def update(self, difference: float):
+        if difference >= Numbers.SceneChangeThreshold:
+            self.interval = self.fastest
+        elif difference < Numbers.FrameGateThreshold:
+            self.interval = min(self.interval * self.backoff, self.static)
+        elif self.interval > self.gameplay:
+            self.interval = self.gameplay
+        else:
+            self.interval = min(self.interval * self.backoff, self.gameplay)
+
+    def reset(self):
+        self.interval = self.fastest
+
+
 class PlayerCache(Emitter):
 
     def __init__(self):
         super().__init__()
         self.players = {}
         self.accounts = set()
+        self.account_index = BKTree()
         self.player_to_legend = {}
         self.account_to_player = {}
         self.account_to_legend_and_rank = {}
@@ -139,10 +279,12 @@ class PlayerCache(Emitter):
 
     def add_account(self, account: str):
         self.accounts.add(account)
+        self.account_index.add(account)
         self.on_event(Events.Player.UpdatedAccounts, self.accounts)
 
     def remove_account(self, account: str):
         self.accounts.remove(account)
+        self.account_index.remove(account)
         self.on_event(Events.Player.UpdatedAccounts, self.accounts)
 
     def add_player(self, player: Player):
@@ -188,6 +330,9 @@ class PlayerCache(Emitter):
         self.legend_to_scores.clear()
         self.account_to_legend_and_rank.clear()
         for legend, account, score in scores:
+            # Correct OCR mistakes (e.g. 'PIayer1') to the closest registered account, unless several are as close
+            budget = edit_budget(account, Numbers.AccountMaxEditDistance)
+            account = self.account_index.closest(account, budget) or account
             self.legend_to_scores[legend].append(score)
             self.account_to_legend_and_rank[account] = (legend, len(self.legend_to_scores[legend]))
 
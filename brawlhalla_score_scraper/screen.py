@@ -1,32 +1,360 @@
-import sys
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Optional, Union
 
 import pyautogui
-import pytesseract
-from numpy import array, int as np_int
+from numpy import abs as np_abs, array, asarray, bincount, int16, ndarray, uint8, int as np_int
 from PIL import Image, ImageEnhance
 
 from .constants import *
+from .digits import get_recognizer
+from .fuzzy import closest, edit_budget
+from .legends import get_classifier
+from .metrics import registry
 from .models import Score
+from .ocr import Mosaic, OCRCache, OCRPool, get_cache, get_engine
 
 
 __all__ = [
+    'Frame',
+    'FrameSource',
+    'LiveFrameSource',
+    'ReplayFrameSource',
+    'get_frame_source',
+    'set_frame_source',
+    'record_frames',
+    'grab_frame',
+    'ProbeResult',
+    'ScreenProbe',
+    'FrameGate',
+    'get_screen_probe',
+    'probe_screen',
     'get_scores_from_screen',
     'is_on_scores_screen',
     'is_on_character_select_screen',
 ]
 
 
-def get_scores_from_screen() -> [(str, str, Score)]:
-    scores = []
+class Frame:
+    """
+    A single screen capture held as an (height, width, 3) RGB array.
+    (x, y) is the position of the top left pixel of the capture on the screen,
+    so regions in screen coordinates can be sliced out without copying.
+    """
+
+    def __init__(self, pixels: ndarray, x: int = 0, y: int = 0):
+        self.pixels = pixels
+        self.x = x
+        self.y = y
+
+    def crop(self, region: 'Region') -> ndarray:
+        x, y = region.x - self.x, region.y - self.y
+        return self.pixels[y:y + region.height, x:x + region.width]
+
+
+class FrameSource(ABC):
+    """
+    Where frames come from, together with the clock the scraper polls them with,
+    so recorded frames can be played back through the scraper like a live screen.
+    """
+
+    @abstractmethod
+    def grab(self, region: Optional['Region'] = None) -> Frame:
+        pass
+
+    @property
+    def exhausted(self) -> bool:
+        return False
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class LiveFrameSource(FrameSource):
+
+    def grab(self, region: Optional['Region'] = None) -> Frame:
+        if region is None:
+            return Frame(asarray(pyautogui.screenshot())[..., :3])
+        image = pyautogui.screenshot(region=region.tuple)
+        return Frame(asarray(image)[..., :3], region.x, region.y)
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Plays back full screen PNG frames from a directory, each named after the time
+    it was captured at in seconds (e.g. '1571234567.250.png'), or a list of
+    (timestamp, pixels) frames. A grab returns the last frame captured at or
+    before the current replay time.
+    In realtime the replay follows the wall clock, otherwise sleeping only advances
+    the replay clock so frames are fed as fast as the scraper can process them.
+    """
+
+    def __init__(self, frames: Union[str, '[(float, ndarray)]'], realtime: bool = True):
+        if isinstance(frames, str):
+            directory, frames = frames, []
+            for filename in os.listdir(directory):
+                name, extension = os.path.splitext(filename)
+                if extension.lower() == '.png':
+                    frames.append((float(name), os.path.join(directory, filename)))
+            if not frames:
+                raise ValueError('No frames found in %s' % directory)
+
+        frames = sorted(frames, key=lambda f: f[0])
+        self.timestamps = [t for t, _ in frames]
+        self.frames = [f for _, f in frames]
+        self.realtime = realtime
+
+        self._elapsed = 0.0
+        self._started_at = None
+        self._loaded = (None, None)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.time() > self.timestamps[-1]
+
+    def time(self) -> float:
+        if not self.realtime:
+            return self.timestamps[0] + self._elapsed
+        if self._started_at is None:
+            self._started_at = time.time()
+        return self.timestamps[0] + time.time() - self._started_at
+
+    def sleep(self, seconds: float):
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self._elapsed += seconds
+
+    def grab(self, region: Optional['Region'] = None) -> Frame:
+        index = max(bisect_right(self.timestamps, self.time()) - 1, 0)
+
+        # Consecutive grabs mostly hit the same frame, keep the last one decoded
+        if self._loaded[0] != index:
+            frame = self.frames[index]
+            if isinstance(frame, str):
+                with Image.open(frame) as image:
+                    frame = asarray(image.convert('RGB'))
+            self._loaded = (index, frame)
+
+        pixels = self._loaded[1]
+        if region is None:
+            return Frame(pixels)
+        return Frame(pixels[region.y:region.y + region.height, region.x:region.x + region.width], region.x, region.y)
+
+
+_frame_source = None
 
-    for i, offset in enumerate(get_score_box_offsets()):
-        score_image = pyautogui.screenshot(region=offset.score_region.tuple)
-        name_image = pyautogui.screenshot(region=offset.name_region.tuple)
-        account_image = pyautogui.screenshot(region=offset.account_region.tuple)
-        account = get_name_from_image(account_image)
+
+def get_frame_source() -> FrameSource:
+    global _frame_source
+    if _frame_source is None:
+        _frame_source = LiveFrameSource()
+    return _frame_source
+
+
+def set_frame_source(source: Optional[FrameSource]):
+    global _frame_source
+    _frame_source = source
+
+
+def record_frames(directory: str, duration: float, interval: float = 0.25):
+    """Saves full screen frames of the live screen to directory for later replay"""
+    os.makedirs(directory, exist_ok=True)
+    source = LiveFrameSource()
+    end = time.time() + duration
+    while time.time() < end:
+        timestamp = time.time()
+        Image.fromarray(source.grab().pixels).save(os.path.join(directory, '%.3f.png' % timestamp))
+        time.sleep(max(0.0, interval - (time.time() - timestamp)))
+
+
+_capture_seconds = registry.histogram('scraper_capture_seconds', 'Time spent capturing frames')
+_read_scores_seconds = registry.histogram('scraper_read_scores_seconds', 'Time spent reading a scoreboard (capture and OCR)')
+
+
+def grab_frame(region: Optional['Region'] = None) -> Frame:
+    with _capture_seconds.time():
+        return get_frame_source().grab(region)
+
+
+# Screen state and the score boxes of the detected layout ([] if no layout matched)
+ProbeResult = namedtuple('ProbeResult', ['on_scores_screen', 'layout', 'offsets'])
+
+
+class ScreenProbe:
+    """
+    Checks every screen state probe point (win label, win label border and the
+    rank labels of each layout) against one capture of their bounding box
+    with a single array comparison.
+    """
+
+    WinLabel: str = 'win_label'
+    WinLabelBorder: str = 'win_label_border'
+
+    def __init__(self):
+        self.layouts = ScoreBoxOffsets.all()
+
+        groups = [
+            (ScreenProbe.WinLabel, Colors.WinLabel, Positions.win_label_offsets()),
+            (ScreenProbe.WinLabelBorder, Colors.WinLabelBorder, Positions.win_label_border_offsets()),
+        ] + [(layout, Colors.RankLabel, [o.rank_offset for o in offsets])
+             for layout, offsets in self.layouts.items()]
+
+        self.groups = [name for name, _, _ in groups]
+        self.points = array([p for _, _, points in groups for p in points], dtype=np_int)
+        self.colors = array([c for _, c, points in groups for _ in points], dtype=uint8)
+        self.group_index = array([i for i, (_, _, points) in enumerate(groups) for _ in points], dtype=np_int)
+
+        left, top = self.points.min(axis=0)
+        right, bottom = self.points.max(axis=0)
+        self.region = Region(left, top, right - left + 1, bottom - top + 1)
+
+    def probe(self, frame: Optional[Frame] = None) -> ProbeResult:
+        if frame is None:
+            frame = grab_frame(self.region)
+        return self.select(self.match(frame))
+
+    def match(self, frame: Frame) -> {str: bool}:
+        """Whether every probe point of each group has its expected color"""
+        pixels = frame.pixels[self.points[:, 1] - frame.y, self.points[:, 0] - frame.x]
+        misses = ~(pixels == self.colors).all(axis=1)
+        matched = bincount(self.group_index, weights=misses, minlength=len(self.groups)) == 0
+        return dict(zip(self.groups, matched))
+
+    def select(self, found: {str: bool}) -> ProbeResult:
+        """Screen state and layout from the matched probe groups"""
+        on_scores_screen = bool(found[ScreenProbe.WinLabel] and found[ScreenProbe.WinLabelBorder])
+
+        # TODO: Add support for teams
+        # TODO: Add support for ranked
+        # TODO: Add support for ranked teams
+        for layout, offsets in self.layouts.items():
+            if found[layout]:
+                return ProbeResult(on_scores_screen, layout, offsets)
+
+        return ProbeResult(on_scores_screen, '', [])
+
+
+class FrameGate:
+    """
+    Measures how much the screen changed since the last frame that was let through,
+    comparing heavily downsampled copies of the frames (mean absolute difference, 0-255).
+    """
+
+    def __init__(self,
+                 step: int = Numbers.FrameGateStep,
+                 threshold: float = Numbers.FrameGateThreshold,
+                 points: Optional[ndarray] = None):
+        self.step = step
+        self.threshold = threshold
+        # (x, y) screen positions that count as a change whenever any of them changes (e.g. probe points)
+        self.points = points
+        self._previous = None
+        self._previous_points = None
+
+    def difference(self, frame: Frame) -> float:
+        small = frame.pixels[::self.step, ::self.step].astype(int16)
+        pixels = None if self.points is None else \
+            frame.pixels[self.points[:, 1] - frame.y, self.points[:, 0] - frame.x]
+
+        if self._previous is None or self._previous.shape != small.shape:
+            difference = float('inf')
+        else:
+            difference = float(np_abs(small - self._previous).mean())
+            if pixels is not None and (pixels != self._previous_points).any():
+                difference = max(difference, self.threshold)
+
+        # Compare against the last changed frame so slow fades still add up past the threshold
+        if difference >= self.threshold:
+            self._previous = small
+            self._previous_points = pixels
+        return difference
+
+    def changed(self, frame: Frame) -> bool:
+        return self.difference(frame) >= self.threshold
+
+    def reset(self):
+        self._previous = None
+
+
+_screen_probe = None
+
+
+def get_screen_probe() -> ScreenProbe:
+    global _screen_probe
+    if _screen_probe is None:
+        _screen_probe = ScreenProbe()
+    return _screen_probe
+
+
+def probe_screen(frame: Optional[Frame] = None) -> ProbeResult:
+    return get_screen_probe().probe(frame)
+
+
+@_read_scores_seconds.timed
+def get_scores_from_screen(frame: Optional[Frame] = None,
+                           offsets: '[ScoreBoxOffsets]' = None,
+                           batched: bool = False,
+                           pool: Optional[OCRPool] = None) -> [(str, str, Score)]:
+    """
+    Reads legend, account and score of every score box on the scoreboard
+    :param frame: capture containing every score box (grabbed if not given)
+    :param offsets: score boxes of the current layout (probed if not given)
+    :param batched: recognize all names, accounts and scores with one OCR call each
+    :param pool: read the score boxes concurrently in the pool's worker processes (takes precedence over batched)
+    """
+    scores = []
+    if offsets is None:
+        offsets = get_score_box_offsets()
+
+    # One capture covering every score box, each label is a view into it
+    if frame is None and offsets:
+        frame = grab_frame(Region.bounding(
+            r for o in offsets for r in (o.score_region, o.name_region, o.account_region)))
+
+    if pool is not None and offsets:
+        # Template matching is faster than sending the score crops to a worker
+        recognizer = get_recognizer()
+        legends = classify_legends([frame.crop(o.name_region) for o in offsets])
+        # Labels are looked up in the cache of this process, only the ones it misses are sent to the workers
+        name_labels = [preprocess_name_image(frame.crop(o.name_region)) if legend is None else None
+                       for o, legend in zip(offsets, legends)]
+        account_labels = [preprocess_name_image(frame.crop(o.account_region)) for o in offsets]
+        name_keys, cached_names = get_cached_names(name_labels)
+        account_keys, cached_accounts = get_cached_names(account_labels)
+        boxes = pool.map(read_score_box,
+                         [label if hit is None else None for label, hit in zip(name_labels, cached_names)],
+                         [label if hit is None else None for label, hit in zip(account_labels, cached_accounts)],
+                         [frame.crop(o.score_region) if recognizer is None else None for o in offsets])
+        names, accounts, data = zip(*boxes)
+        names = cache_names(name_keys, cached_names, names)
+        accounts = cache_names(account_keys, cached_accounts, accounts)
+        if recognizer is not None:
+            data = [recognizer.recognize(frame.crop(o.score_region)) for o in offsets]
+        names = [correct_legend(name) if legend is None else legend for name, legend in zip(names, legends)]
+        return [(name, account, Score(i + 1, score))
+                for i, (name, account, score) in enumerate(zip(names, accounts, data))]
+
+    if batched and offsets:
+        names = get_legends_from_images([frame.crop(o.name_region) for o in offsets])
+        accounts = get_names_from_images([frame.crop(o.account_region) for o in offsets])
+        data = get_score_data_from_images([frame.crop(o.score_region) for o in offsets])
+        return [(name, account, Score(i + 1, score))
+                for i, (name, account, score) in enumerate(zip(names, accounts, data))]
+
+    for i, offset in enumerate(offsets):
+        score_image = frame.crop(offset.score_region)
+        name_image = frame.crop(offset.name_region)
+        account_image = frame.crop(offset.account_region)
         scores.append((
-            get_name_from_image(name_image),
-            ScoreBoxOffsets.AccountAlias.get(account, account),
+            get_legend_from_image(name_image),
+            get_name_from_image(account_image),
             Score(i + 1, get_score_data_from_image(score_image))
         ))
 
@@ -34,8 +362,7 @@ def get_scores_from_screen() -> [(str, str, Score)]:
 
 
 def is_on_scores_screen() -> bool:
-    return color_at_points(Colors.WinLabel, Positions.win_label_offsets()) \
-           and color_at_points(Colors.WinLabelBorder, Positions.win_label_border_offsets())
+    return probe_screen().on_scores_screen
 
 
 def is_on_character_select_screen() -> bool:
@@ -48,10 +375,17 @@ def is_on_character_select_screen() -> bool:
 
 class Region:
     def __init__(self, x: int, y: int, width: int, height: int):
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
+        self.x = int(x)
+        self.y = int(y)
+        self.width = int(width)
+        self.height = int(height)
+
+    @staticmethod
+    def bounding(regions) -> 'Region':
+        corners = [r.corners for r in regions]
+        left, top = min(c[0] for c in corners), min(c[1] for c in corners)
+        right, bottom = max(c[2] for c in corners), max(c[3] for c in corners)
+        return Region(left, top, right - left, bottom - top)
 
     @property
     def corners(self):
@@ -64,11 +398,6 @@ class Region:
 
 class ScoreBoxOffsets:
 
-    # TODO: Replace AccountAlias with improved account name recognition
-    AccountAlias: {str: str} = {
-        'PlayerI': 'Player1',
-    }
-
     def __init__(self, position: Vec2, player_index: int = 0):
 
         multiplier = array([player_index, 0 if not player_index else 1], dtype=np_int)
@@ -96,40 +425,159 @@ class ScoreBoxOffsets:
 
 
 def color_at_point(color: Color, point: Vec2) -> bool:
-    return color == pyautogui.pixel(int(point[0]), int(point[1]))
+    return colors_at_points([(point, color)])
 
 
 def color_at_points(color: Color, points: [Vec2]) -> bool:
-    return all(color_at_point(color, p) for p in points)
+    return colors_at_points([(p, color) for p in points])
 
 
 def colors_at_points(points_and_colors: [(Vec2, Color)]) -> bool:
-    return all(color_at_point(c, p) for p, c in points_and_colors)
+    if not points_and_colors:
+        return True
+
+    points = array([p for p, _ in points_and_colors], dtype=np_int)
+    colors = array([c for _, c in points_and_colors], dtype=uint8)
+
+    # Capture only the bounding box of the points instead of one screenshot per pixel
+    left, top = points.min(axis=0)
+    right, bottom = points.max(axis=0)
+    frame = grab_frame(Region(left, top, right - left + 1, bottom - top + 1))
+
+    pixels = frame.pixels[points[:, 1] - frame.y, points[:, 0] - frame.x]
+    return bool((pixels == colors).all())
 
 
 def get_score_box_offsets() -> [ScoreBoxOffsets]:
-    # TODO: Add support for teams
-    # TODO: Add support for ranked
-    # TODO: Add support for ranked teams
-    for _, offsets in ScoreBoxOffsets.all().items():
-        if color_at_points(Colors.RankLabel, map(lambda x: x.rank_offset, offsets)):
-            return offsets
-    return []
-
-
-def get_name_from_image(image: Image.Image) -> str:
-    prefix = '-' if sys.platform in {'win32', 'cygwin'} else ''
-    enhancer = ImageEnhance.Sharpness(image)
+    return probe_screen().offsets
+
+
+def as_image(image: Union[Image.Image, ndarray]) -> Image.Image:
+    return Image.fromarray(image) if isinstance(image, ndarray) else image
+
+
+def preprocess_name_image(image: Union[Image.Image, ndarray]) -> Image.Image:
+    enhancer = ImageEnhance.Sharpness(as_image(image))
     enhanced = enhancer.enhance(Numbers.NameLabelSharpnessEnhanceFactor)
-    threshold = enhanced.point(lambda p: p > Numbers.NameLabelWhiteThreshold and 255)
-    text = pytesseract.image_to_string(threshold, lang='eng', config=prefix + '-psm 7')
-    return text.replace(' ', '')
+    return enhanced.point(lambda p: p > Numbers.NameLabelWhiteThreshold and 255)
+
+
+def parse_name(text: str) -> str:
+    return text.strip().replace(' ', '')
+
+
+def parse_score_data(lines: [str]) -> (int, int, int, int, int, int):
+    return tuple(map(lambda v: int(v), filter(lambda v: v != '', (line.strip() for line in lines))))
+
+
+def read_name(threshold: Image.Image) -> str:
+    """OCRs a preprocessed name label, without the cache"""
+    return parse_name(get_engine().image_to_string(threshold, 'eng', Numbers.NameLabelPageSegMode))
+
+
+def get_name_from_image(image: Union[Image.Image, ndarray]) -> str:
+    threshold = preprocess_name_image(image)
+    key = OCRCache.hash(threshold)
+    name = get_cache().get(key)
+    if name is None:
+        name = read_name(threshold)
+        get_cache().put(key, name)
+    return name
+
+
+def get_cached_names(thresholds: [Optional[Image.Image]]) -> ([Optional[int]], [Optional[str]]):
+    """Cache keys and cached names of preprocessed name labels (None for missing labels and cache misses)"""
+    keys = [None if threshold is None else OCRCache.hash(threshold) for threshold in thresholds]
+    return keys, [None if key is None else get_cache().get(key) for key in keys]
+
+
+def cache_names(keys: [Optional[int]], cached: [Optional[str]], names: [str]) -> [str]:
+    """Cached names where there was one, otherwise the names read, which are added to the cache"""
+    result = []
+    for key, hit, name in zip(keys, cached, names):
+        if hit is None and key is not None:
+            get_cache().put(key, name)
+        result.append(name if hit is None else hit)
+    return result
+
+
+def get_names_from_images(images: [Union[Image.Image, ndarray]]) -> [str]:
+    thresholds = [preprocess_name_image(image) for image in images]
+    keys = [OCRCache.hash(threshold) for threshold in thresholds]
+    names = [get_cache().get(key) for key in keys]
+
+    # Only labels that were not seen before go through OCR
+    missing = [i for i, name in enumerate(names) if name is None]
+    if missing:
+        mosaic = Mosaic([thresholds[i] for i in missing], Numbers.MosaicSeparator, 0)
+        lines = mosaic.recognize(get_engine(), 'eng', Numbers.MosaicPageSegMode)
+        for i, text in zip(missing, lines):
+            names[i] = parse_name(''.join(text))
+            get_cache().put(keys[i], names[i])
+
+    return names
+
+
+def correct_legend(name: str) -> str:
+    """Snaps an OCR'd name label to the closest legend, if one is close enough"""
+    if Legends.exists(name):
+        return name
+    return closest(name, Legends.all, edit_budget(name, Numbers.LegendMaxEditDistance)) or name
+
+
+def classify_legends(images: [Union[Image.Image, ndarray]]) -> [Optional[str]]:
+    """Legend of every name label the classifier is confident about (None for the others)"""
+    classifier = get_classifier()
+    if classifier is None or not images:
+        return [None] * len(images)
+    return [legend if confidence >= Numbers.LegendMinConfidence else None
+            for legend, confidence in classifier.classify_all(images)]
+
+
+def get_legend_from_image(image: Union[Image.Image, ndarray]) -> str:
+    legend = classify_legends([image])[0]
+    return legend if legend is not None else correct_legend(get_name_from_image(image))
+
+
+def get_legends_from_images(images: [Union[Image.Image, ndarray]]) -> [str]:
+    legends = classify_legends(images)
+
+    # Only labels the classifier is unsure about go through OCR
+    missing = [i for i, legend in enumerate(legends) if legend is None]
+    if missing:
+        for i, name in zip(missing, get_names_from_images([images[i] for i in missing])):
+            legends[i] = correct_legend(name)
+
+    return legends
+
+
+def get_score_data_from_image(image: Union[Image.Image, ndarray]) -> (int, int, int, int, int, int):
+    recognizer = get_recognizer()
+    if recognizer is not None:
+        return recognizer.recognize(image)
+    text = get_engine().image_to_string(as_image(image), 'numbers', Numbers.ScoreAreaPageSegMode)
+    return parse_score_data(text.split('\n'))
+
 
+def read_score_box(name_label: Optional[Image.Image], account_label: Optional[Image.Image],
+                   score_image: Optional[ndarray]) -> (str, str, (int, int, int, int, int, int)):
+    """
+    Reads the preprocessed name and account labels and the score area of one score box in an OCRPool
+    worker, skipping the missing ones. The worker has no cache, the caller looks labels up in its own.
+    """
+    name = read_name(name_label) if name_label is not None else ''
+    account = read_name(account_label) if account_label is not None else ''
+    score = get_score_data_from_image(score_image) if score_image is not None else ()
+    return name, account, score
 
-def get_score_data_from_image(image: Image.Image) -> (int, int, int, int, int, int):
-    prefix = '-' if sys.platform in {'win32', 'cygwin'} else ''
-    text = pytesseract.image_to_string(image, lang='numbers', config=prefix + '-psm 6')
-    return tuple(map(lambda v: int(v), filter(lambda v: v != '', text.split('\n'))))
+
+def get_score_data_from_images(images: [Union[Image.Image, ndarray]]) -> [(int, int, int, int, int, int)]:
+    recognizer = get_recognizer()
+    if recognizer is not None:
+        return [recognizer.recognize(image) for image in images]
+    mosaic = Mosaic([as_image(image) for image in images], Numbers.MosaicSeparator)
+    lines = mosaic.recognize(get_engine(), 'numbers', Numbers.MosaicPageSegMode)
+    return [parse_score_data(text) for text in lines]
 
 
 # endregion
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from contextlib import contextmanager
+from multiprocessing.connection import Connection
+from typing import Any
+
+from aiohttp import web
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from ..constants import Events, Numbers
+from ..delegate import Delegate, FanOutDelegate
+from .events import MatchStream
+from .server import EventStreamHeaders, PushEvents, RemotePlayerServerDelegate, event_json, handle_request
+
+
+__all__ = [
+    'WebSocketHub',
+    'create_app',
+    'run_app',
+]
+
+
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+                        autoescape=select_autoescape(['html']))
+
+
+class WebSocketHub(Delegate):
+    """
+    Pushes the PushEvents of the application to every connected browser. Every browser has a
+    queue of Numbers.WebSocketQueueSize messages, when it is full the oldest message is dropped.
+    Browsers are sent the last live players and accounts when they connect.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int = Numbers.WebSocketQueueSize):
+        self.loop = loop
+        self.queue_size = queue_size
+        self.queues = set()
+        # Last message of every event describing the whole state
+        self.state = {}
+
+    def on_event(self, event: str, data: Any = None):
+        # Called on the thread reading the bridge, encoded there so the loop only queues text
+        if event in PushEvents:
+            self.loop.call_soon_threadsafe(self.broadcast, event, event_json(event, data))
+
+    def broadcast(self, event: str, message: str):
+        if event != Events.Player.NewScores:
+            self.state[event] = message
+        for queue in self.queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def serve(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=Numbers.WebSocketHeartbeat)
+        await ws.prepare(request)
+
+        queue = asyncio.Queue(self.queue_size)
+        for message in self.state.values():
+            queue.put_nowait(message)
+        self.queues.add(queue)
+        sender = asyncio.ensure_future(_send_all(ws, queue))
+        try:
+            # Browsers only listen, this returns when they disconnect
+            async for _ in ws:
+                pass
+        finally:
+            self.queues.discard(queue)
+            sender.cancel()
+        return ws
+
+
+async def _send_all(ws: web.WebSocketResponse, queue: asyncio.Queue):
+    while True:
+        await ws.send_str(await queue.get())
+
+
+async def home(request: web.Request) -> web.Response:
+    delegate = request.app['delegate']
+    loop = asyncio.get_event_loop()
+
+    # Answers of the application are waited for on executor threads, never on the loop
+    if request.method == "GET":  # Players GUI
+        accounts = await loop.run_in_executor(None, delegate.get_accounts)
+        return web.Response(text=templates.get_template('index.html').render(accounts=accounts),
+                            content_type='text/html')
+
+    status = await loop.run_in_executor(None, handle_request, delegate, request.method, dict(request.query))
+    return web.Response(status=status)
+
+
+async def metrics(request: web.Request) -> web.Response:
+    text = await asyncio.get_event_loop().run_in_executor(None, request.app['delegate'].get_metrics)
+    return web.Response(text=text, headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+async def websocket(request: web.Request) -> web.WebSocketResponse:
+    with _open_stream(request):
+        return await request.app['hub'].serve(request)
+
+
+async def events(request: web.Request) -> web.StreamResponse:
+    stream = request.app['events']
+    loop = asyncio.get_event_loop()
+    wake = asyncio.Event()
+    # Matches are published on the thread reading the bridge
+    subscription = stream.subscribe(request.headers.get('Last-Event-ID'), lambda: loop.call_soon_threadsafe(wake.set))
+
+    response = web.StreamResponse(headers=EventStreamHeaders)
+    response.content_type = 'text/event-stream'
+    try:
+        with _open_stream(request):
+            await response.prepare(request)
+            # Matches missed since Last-Event-ID are waiting already
+            await response.write((stream.header() + subscription.take()).encode())
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), Numbers.EventKeepAlive)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                await response.write((subscription.take() or stream.keep_alive()).encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        stream.unsubscribe(subscription)
+    return response
+
+
+@contextmanager
+def _open_stream(request: web.Request):
+    """Registers the task of a handler that only returns when its client disconnects"""
+    task = asyncio.current_task()
+    request.app['streams'].add(task)
+    try:
+        yield
+    finally:
+        request.app['streams'].discard(task)
+
+
+async def _close_streams(app: web.Application):
+    # Shutting down waits for every handler to return, streams would keep the server process alive
+    for task in list(app['streams']):
+        task.cancel()
+
+
+def create_app(delegate: RemotePlayerServerDelegate, hub: WebSocketHub, stream: MatchStream) -> web.Application:
+    app = web.Application()
+    app['delegate'] = delegate
+    app['hub'] = hub
+    app['events'] = stream
+    app['streams'] = set()
+    app.on_shutdown.append(_close_streams)
+    app.router.add_route('*', '/', home)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/ws', websocket)
+    app.router.add_get('/events', events)
+    return app
+
+
+def run_app(address: (str, int), ports: Connection, authkey: bytes):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    hub = WebSocketHub(loop)
+    stream = MatchStream()
+    delegate = RemotePlayerServerDelegate()
+    # Events pushed by the application go to the browsers and the /events subscribers
+    delegate.delegate = FanOutDelegate(hub, stream)
+    delegate.connect(0, authkey)
+    ports.send(delegate.port)
+    ports.close()
+    delegate.wait_for_client()
+
+    web.run_app(create_app(delegate, hub, stream), host=address[0], port=address[1], print=None, loop=loop)
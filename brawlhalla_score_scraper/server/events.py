@@ -0,0 +1,119 @@
+import json
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from ..constants import Events, Numbers
+from ..delegate import Delegate
+from ..models import LivePlayer, Score
+
+
+__all__ = [
+    'MatchStream',
+    'Subscription',
+    'score_dicts',
+]
+
+
+def score_dicts(scores: [(LivePlayer, Score)]) -> [dict]:
+    """The scores of a match as JSON objects"""
+    return [{'name': player.player.name, 'legend': player.legend, 'rank': score.rank,
+             'score': score.score, 'kos': score.kos, 'falls': score.falls, 'accidents': score.accidents,
+             'dmg_done': score.dmg_done, 'dmg_taken': score.dmg_taken}
+            for player, score in scores]
+
+
+class Subscription:
+    """
+    Server-Sent Events messages waiting to be sent to one subscriber of a MatchStream.
+    notify is called (on the thread publishing) every time a message is added.
+    """
+
+    def __init__(self, size: int, notify: Callable[[], None]):
+        self.messages = deque(maxlen=size)
+        self.notify = notify
+
+    def put(self, message: str):
+        # The oldest message is dropped when the deque is full
+        self.messages.append(message)
+        self.notify()
+
+    def take(self) -> str:
+        """Removes and returns every waiting message"""
+        messages = []
+        while self.messages:
+            messages.append(self.messages.popleft())
+        return ''.join(messages)
+
+
+class MatchStream(Delegate):
+    """
+    Fans the matches committed by the application (NewScores) out to the subscribers of the /events
+    Server-Sent Events endpoint. Every subscriber buffers at most Numbers.EventQueueSize matches and
+    the oldest is dropped when a slow subscriber is full, so publishing never waits for subscribers.
+    Matches get sequential ids and the last Numbers.EventHistorySize are kept: a subscriber reconnecting
+    with Last-Event-ID first gets the matches published after that id.
+    """
+
+    def __init__(self, queue_size: int = Numbers.EventQueueSize, history: int = Numbers.EventHistorySize):
+        self.queue_size = queue_size
+        # Ids restart with the server process, ids of an earlier process are told apart by this prefix
+        self.run_id = uuid4().hex
+        self._lock = Lock()
+        self._history = deque(maxlen=history)
+        self._subscriptions = set()
+        self._sequence = 0
+
+    def on_event(self, event: str, data: Any = None):
+        if event == Events.Player.NewScores:
+            self.publish(event, score_dicts(data))
+
+    def publish(self, event: str, data: Any):
+        with self._lock:
+            self._sequence += 1
+            message = 'id: %s-%d\nevent: %s\ndata: %s\n\n' % (self.run_id, self._sequence, event, json.dumps(data))
+            self._history.append((self._sequence, message))
+            for subscription in self._subscriptions:
+                subscription.put(message)
+
+    def subscribe(self, last_event_id: Optional[str], notify: Callable[[], None]) -> Subscription:
+        """Subscription to the matches published from now on, and the ones after last_event_id"""
+        with self._lock:
+            after = self._resume_after(last_event_id)
+            missed = [] if after is None else [message for sequence, message in self._history if sequence > after]
+            # Missed matches do not count against the buffer, they are all sent on resume
+            subscription = Subscription(self.queue_size + len(missed), notify)
+            subscription.messages.extend(missed)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @staticmethod
+    def header() -> str:
+        """Sent first on every stream, sets the reconnection delay of EventSource"""
+        return 'retry: %d\n\n' % Numbers.EventRetry
+
+    @staticmethod
+    def keep_alive() -> str:
+        return ': keep-alive\n\n'
+
+    # region Detail
+
+    def _resume_after(self, last_event_id: Optional[str]) -> Optional[int]:
+        """Sequence after which history is resent, None for a new subscriber"""
+        if not last_event_id:
+            return None
+        run_id, _, sequence = last_event_id.partition('-')
+        if run_id != self.run_id:
+            # Every match of this process is newer than the ones of the earlier process
+            return 0
+        try:
+            return int(sequence)
+        except ValueError:
+            return None
+
+    # endregion
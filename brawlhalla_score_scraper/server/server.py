@@ -1,24 +1,39 @@
 import os
+import json
 import logging
 from abc import abstractmethod
-from multiprocessing import Process
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from threading import Event
+from typing import Any, Optional
 
-from flask import Flask, Blueprint, request, render_template, make_response, current_app
+from flask import Flask, Blueprint, Response, request, render_template, make_response, current_app
+from werkzeug.serving import make_server
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 from ..constants import Events, Numbers, Runnable
 from ..delegate import Delegate, check_event, on_event, SocketDelegate, SocketEmitter
+from .events import MatchStream, score_dicts
 
 
 __all__ = [
     'PlayerServer',
-    'PlayerServerDelegate'
+    'PlayerServerDelegate',
+    'PlayerServerBridge',
+    'RemotePlayerServerDelegate',
+    'PushEvents',
+    'handle_request',
+    'event_json',
+    'EventStreamHeaders',
 ]
 
 
-os.environ['WERKZEUG_RUN_MAIN'] = 'true'
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
-delegate = None
 player_gui = Blueprint('player_gui', __name__, template_folder='templates')
 
 
@@ -27,78 +42,206 @@ class PlayerServerDelegate(Delegate):
     def get_accounts(self) -> [str]:
         pass
 
+    @abstractmethod
+    def get_metrics(self) -> str:
+        pass
+
 
-class PlayerServer(Runnable):
+# Events of the application pushed to the browsers
+PushEvents = (
+    Events.Player.UpdatedLivePlayers,
+    Events.Player.UpdatedPlayerAccounts,
+    Events.Player.NewScores,
+)
 
-    def __init__(self, host: str):
-        self.address = (host, Numbers.Port)
-        self._process = None
 
-    @property
-    def delegate(self):
-        # return 0
-        return delegate
+class Codes:
+    """Custom request codes of the player server bridge"""
+    Accounts: str = 'accounts'
+    Metrics: str = 'metrics'
+
+
+class PlayerServerBridge(SocketDelegate):
+    """Answers the requests of the server process with the delegate of this process"""
+
+    def __init__(self, delegate: PlayerServerDelegate):
+        super().__init__()
+        self.delegate = delegate
+
+    def check_event(self, event: str, data: Any = None) -> int:
+        return check_event(self.delegate, event, data)
+
+    def on_event(self, event: str, data: Any = None):
+        on_event(self.delegate, event, data)
 
-    @delegate.setter
-    def delegate(self, value: PlayerServerDelegate):
-        # pass
-        global delegate
-        delegate = value
+    def on_custom_event(self, code: str, event: str, data: Any) -> Any:
+        if code == Codes.Accounts:
+            return self.delegate.get_accounts()
+        elif code == Codes.Metrics:
+            return self.delegate.get_metrics()
+
+
+class RemotePlayerServerDelegate(SocketEmitter, PlayerServerDelegate):
+    """Delegate of the server process, forwarding every call to the PlayerServerBridge of the application"""
+
+    def get_accounts(self) -> [str]:
+        return self.request(Codes.Accounts)
+
+    def get_metrics(self) -> str:
+        return self.request(Codes.Metrics)
+
+
+class PlayerServer(Runnable, Delegate):
+    """
+    Runs the player web server in its own process. With aiohttp installed the server is asynchronous
+    and pushes PushEvents to the browsers over a WebSocket, otherwise it is a threaded Flask server.
+    Both stream the committed matches to /events subscribers (Server-Sent Events, see MatchStream).
+    """
+
+    def __init__(self, host: str, asynchronous: Optional[bool] = None):
+        self.address = (host, Numbers.Port)
+        self.asynchronous = aiohttp is not None if asynchronous is None else asynchronous
+        self.delegate = None
+        self._process = None
+        self._bridge = None
 
     def run(self):
-        self._process = Process(target=_run_app, args=(self.address,))
+        if self.asynchronous:
+            from .aio import run_app
+        else:
+            run_app = _run_app
+
+        # Only this process and the server process know the key, the bridge only accepts connections using it
+        authkey = os.urandom(32)
+        # The server process listens for the bridge on a port picked by the OS and sends it back
+        ports, server_ports = Pipe(duplex=False)
+        self._process = Process(target=run_app, args=(self.address, server_ports, authkey))
         self._process.start()
+        # The server process holds the only sending end now, receiving fails once it exits
+        server_ports.close()
+        try:
+            bridge_port = ports.recv()
+        except EOFError:
+            self._process.join()
+            raise RuntimeError('Player server process exited with code %s before listening for the bridge'
+                               % self._process.exitcode) from None
+        finally:
+            ports.close()
+
+        self._bridge = PlayerServerBridge(self.delegate)
+        self._bridge.connect(bridge_port, authkey)
 
         print('\033[91m' 
               '* Running on http://%s:%d/ (Press CTRL+C to quit)'
               '\033[0m' % self.address)
 
     def stop(self):
-        self._process.terminate()
-        self._process.join()
-
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
 
-@player_gui.route('/', methods=['GET', 'POST', 'DELETE', 'UPDATE'])
-def home():
-
-    # delegate = current_app.delegate
+    def on_event(self, event: str, data: Any = None):
+        if event in PushEvents and self._bridge is not None:
+            self._bridge.push(event, data)
 
-    if request.method == "GET":  # Players GUI
-        return render_template('index.html', accounts=delegate.get_accounts())
 
-    elif request.method == "POST":  # Add player
-        name, legend = request.args['name'], request.args['legend'].upper()
+def handle_request(delegate: PlayerServerDelegate, method: str, args: {str: str}) -> int:
+    """
+    Applies a POST (add player), DELETE (remove player) or UPDATE/PATCH (set account) request of the players GUI
+    :return: the status code of the response
+    """
+    if method == "POST":  # Add player
+        name, legend = args['name'], args['legend'].upper()
 
         code = check_event(delegate, Events.Server.SetPlayer, [name, legend])
         if code:
-            return make_response("", 400 + code)
+            return 400 + code
 
         on_event(delegate, Events.Server.SetPlayer, [name, legend])
 
-    elif request.method == "DELETE":  # Remove player
-        name = request.args['name']
+    elif method == "DELETE":  # Remove player
+        name = args['name']
         if not check_event(delegate, Events.Server.DeletePlayer, [name]):
-            return make_response("", 401)
+            return 401
 
         on_event(delegate, Events.Server.DeletePlayer, [name])
 
-    elif request.method == "UPDATE":  # Update player account
-        name, account = request.args['name'], request.args['account']
+    # The C parser of aiohttp only accepts registered methods, which UPDATE is not
+    elif method == "UPDATE" or method == "PATCH":  # Update player account
+        name, account = args['name'], args['account']
 
         code = check_event(delegate, Events.Server.SetAccount, [name, account])
         if code:
-            return make_response("", 400 + code)
+            return 400 + code
 
         on_event(delegate, Events.Server.SetAccount, [name, account])
 
-    return make_response("", 200)
+    return 200
+
+
+def event_json(event: str, data: Any) -> str:
+    """{"event": event, "data": data} of a PushEvents event, scores as a list of objects"""
+    if event == Events.Player.NewScores:
+        data = score_dicts(data)
+    return json.dumps({'event': event, 'data': data})
+
+
+@player_gui.route('/', methods=['GET', 'POST', 'DELETE', 'UPDATE', 'PATCH'])
+def home():
+
+    delegate = current_app.delegate
+
+    if request.method == "GET":  # Players GUI
+        return render_template('index.html', accounts=delegate.get_accounts())
+
+    return make_response("", handle_request(delegate, request.method, request.args))
+
+
+@player_gui.route('/metrics', methods=['GET'])
+def metrics():
+    delegate = current_app.delegate
+    response = make_response(delegate.get_metrics(), 200)
+    response.mimetype = 'text/plain; version=0.0.4'
+    return response
+
+
+# Headers of /events responses, proxies must not buffer or cache the stream
+EventStreamHeaders = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+@player_gui.route('/events', methods=['GET'])
+def events():
+    stream = current_app.events
+    wake = Event()
+    subscription = stream.subscribe(request.headers.get('Last-Event-ID'), wake.set)
+
+    # Runs on the thread of the request until the client disconnects (the next write fails)
+    def generate():
+        try:
+            # Matches missed since Last-Event-ID are waiting already
+            yield stream.header() + subscription.take()
+            while True:
+                wake.wait(Numbers.EventKeepAlive)
+                wake.clear()
+                yield subscription.take() or stream.keep_alive()
+        finally:
+            stream.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers=EventStreamHeaders)
 
 
-def _run_app(address: (str, int)):
+def _run_app(address: (str, int), ports: Connection, authkey: bytes):
     app = Flask(__name__)
     app.register_blueprint(player_gui)
-    # app.delegate = SocketEmitter()
-    # app.delegate.connect(4000)
-    # app.delegate.wait_for_client()
-    app.run(host=address[0], port=address[1], threaded=False)
+    app.events = MatchStream()
+    app.delegate = RemotePlayerServerDelegate()
+    # Events pushed by the application go to the /events subscribers
+    app.delegate.delegate = app.events
+    app.delegate.connect(0, authkey)
+    ports.send(app.delegate.port)
+    ports.close()
+    app.delegate.wait_for_client()
+    # Requests of different clients wait for their answers from the application concurrently
+    # (served directly instead of app.run, which prints a banner and reloader messages)
+    make_server(address[0], address[1], app, threaded=True).serve_forever()
 
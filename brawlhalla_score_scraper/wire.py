@@ -0,0 +1,377 @@
+import pickle
+import struct
+from typing import Any
+
+from .constants import Color, Events
+from .models import LivePlayer, Player, Score
+
+
+__all__ = [
+    'Version',
+    'Kind',
+    'Symbols',
+    'DeltaEvents',
+    'Encoder',
+    'Decoder',
+]
+
+
+# Version of the encoding, first byte of every frame (2: Events.Database.Failed moved the symbol codes)
+Version = 2
+
+
+class Kind:
+    """Second byte of every frame"""
+    Requests: int = 0
+    Answers: int = 1
+
+
+# Strings sent as a single byte: request codes, event names and legends. The index is the code: new symbols
+# are appended, removing or reordering one needs a new Version. Strings missing here are sent in full.
+Symbols = (
+    'c', 'e', 'accounts', 'metrics',
+    Events.Command.AddAccount, Events.Command.AddPlayer, Events.Command.Export, Events.Command.Import,
+    Events.Command.Pause, Events.Command.RebuildStats, Events.Command.RemoveAccount, Events.Command.RemovePlayer,
+    Events.Player.NewScores, Events.Player.UpdatedAccounts, Events.Player.UpdatedLivePlayers,
+    Events.Player.UpdatedPlayerAccounts, Events.Player.UpdatedPlayers,
+    Events.Database.Failed, Events.Database.Written,
+    Events.Server.DeletePlayer, Events.Server.SetAccount, Events.Server.SetPlayer,
+    'ADA', 'ARTEMIS', 'ASURI', 'AZOTH', 'BARRAZA', 'BODVAR', 'BRYNN', 'CASPIAN', 'CASSIDY', 'CROSS',
+    'DIANA', 'DUSK', 'EMBER', 'FAIT', 'GNASH', 'HATTORI', 'ISAIAH', 'JHALA', 'JIRO', 'KAYA',
+    'KOJI', 'KOR', 'LINFEI', 'LORDVRAXX', 'LUCIEN', 'MIRAGE', 'MORDEX', 'NIX', 'ORION', 'PETRA',
+    'QUEENNAI', 'RAGNIR', 'RAYMAN', 'SCARLET', 'SENTINEL', 'SIDRA', 'SIRROLAND', 'TEROS', 'THATCH', 'THOR',
+    'ULGRIM', 'VAL', 'VECTOR', 'WUSHANG', 'XULL', 'YUMIKO', 'ZARIEL',
+)
+
+# Events carrying a whole map or set of which only the changes since the last one are sent
+DeltaEvents = frozenset((
+    Events.Player.UpdatedAccounts,
+    Events.Player.UpdatedPlayers,
+    Events.Player.UpdatedPlayerAccounts,
+    Events.Player.UpdatedLivePlayers,
+))
+
+
+class Encoder:
+    """
+    Encodes frames for one connection. A frame is (version, kind, message count) followed by the
+    messages: requests are (id, code, event, data), answers are (id, result). Values are packed with
+    struct behind a one byte tag and objects without a tag are pickled. The data of DeltaEvents is
+    sent as the difference to the data of the previous event of the same name.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+
+    def frame(self, kind: int, messages: [tuple]) -> bytes:
+        out = bytearray(_header.pack(Version, kind, len(messages)))
+        if kind == Kind.Requests:
+            for request_id, code, event, data in messages:
+                out += _id.pack(-1 if request_id is None else request_id)
+                _write_symbol(out, code)
+                _write_symbol(out, event)
+                if code == 'e' and event in DeltaEvents:
+                    self._write_delta(out, event, data)
+                else:
+                    _write(out, data)
+        else:
+            for request_id, result in messages:
+                out += _id.pack(request_id)
+                _write(out, result)
+        return bytes(out)
+
+    def _write_delta(self, out: bytearray, event: str, data: Any):
+        previous = self._snapshots.get(event)
+        if isinstance(data, dict) and isinstance(previous, dict):
+            out += b'D'
+            _write(out, [key for key in previous if key not in data])
+            _write(out, {key: value for key, value in data.items()
+                         if key not in previous or previous[key] != value})
+        elif isinstance(data, (set, frozenset)) and isinstance(previous, (set, frozenset)):
+            out += b'E'
+            _write(out, list(previous - data))
+            _write(out, list(data - previous))
+        else:
+            _write(out, data)
+
+        if isinstance(data, dict):
+            self._snapshots[event] = dict(data)
+        elif isinstance(data, (set, frozenset)):
+            self._snapshots[event] = set(data)
+        else:
+            self._snapshots.pop(event, None)
+
+
+class Decoder:
+    """Decodes the frames of one Encoder, in the order they were encoded"""
+
+    def __init__(self):
+        self._snapshots = {}
+
+    def frame(self, data: bytes) -> (int, [tuple]):
+        """:return: the kind of the frame and its messages"""
+        version, kind, count = _header.unpack_from(data)
+        if version != Version:
+            raise ValueError('Unsupported wire version %d (expected %d)' % (version, Version))
+
+        view, offset, messages = memoryview(data), _header.size, []
+        for _ in range(count):
+            request_id, = _id.unpack_from(view, offset)
+            offset += _id.size
+            if kind == Kind.Requests:
+                code, offset = _read_symbol(view, offset)
+                event, offset = _read_symbol(view, offset)
+                if code == 'e' and event in DeltaEvents:
+                    value, offset = self._read_delta(view, offset, event)
+                else:
+                    value, offset = _read(view, offset)
+                messages.append((None if request_id < 0 else request_id, code, event, value))
+            else:
+                value, offset = _read(view, offset)
+                messages.append((request_id, value))
+        return kind, messages
+
+    def _read_delta(self, view: memoryview, offset: int, event: str) -> (Any, int):
+        tag = view[offset:offset + 1].tobytes()
+        if tag == b'D':
+            removed, offset = _read(view, offset + 1)
+            changed, offset = _read(view, offset)
+            # A new object every time, the previous one may still be used by the delegate
+            value = dict(self._snapshots[event])
+            for key in removed:
+                del value[key]
+            value.update(changed)
+        elif tag == b'E':
+            removed, offset = _read(view, offset + 1)
+            added, offset = _read(view, offset)
+            value = (self._snapshots[event] - set(removed)) | set(added)
+        else:
+            value, offset = _read(view, offset)
+
+        if isinstance(value, (dict, set)):
+            self._snapshots[event] = value
+        else:
+            self._snapshots.pop(event, None)
+        return value, offset
+
+
+# region Detail
+
+_header = struct.Struct('!BBI')
+_id = struct.Struct('!i')
+_byte = struct.Struct('!b')
+_int = struct.Struct('!i')
+_long = struct.Struct('!q')
+_float = struct.Struct('!d')
+_length = struct.Struct('!I')
+_color = struct.Struct('!BBB')
+_score = struct.Struct('!b6i')
+
+_symbol_codes = {symbol: i for i, symbol in enumerate(Symbols)}
+
+
+def _write_length(out: bytearray, length: int):
+    # One byte for lengths below 255, the usual case
+    if length < 255:
+        out.append(length)
+    else:
+        out.append(255)
+        out += _length.pack(length)
+
+
+def _read_length(view: memoryview, offset: int) -> (int, int):
+    length = view[offset]
+    if length < 255:
+        return length, offset + 1
+    return _length.unpack_from(view, offset + 1)[0], offset + 1 + _length.size
+
+
+def _write_str(out: bytearray, value: str):
+    encoded = value.encode()
+    _write_length(out, len(encoded))
+    out += encoded
+
+
+def _read_str(view: memoryview, offset: int) -> (str, int):
+    length, offset = _read_length(view, offset)
+    return view[offset:offset + length].tobytes().decode(), offset + length
+
+
+def _write_symbol(out: bytearray, value: str):
+    code = _symbol_codes.get(value)
+    if code is None:
+        out.append(255)
+        _write_str(out, value)
+    else:
+        out.append(code)
+
+
+def _read_symbol(view: memoryview, offset: int) -> (str, int):
+    code = view[offset]
+    if code == 255:
+        return _read_str(view, offset + 1)
+    return Symbols[code], offset + 1
+
+
+def _write_int(out: bytearray, value: int):
+    if -128 <= value < 128:
+        out += b'b'
+        out += _byte.pack(value)
+    elif -2 ** 31 <= value < 2 ** 31:
+        out += b'i'
+        out += _int.pack(value)
+    elif -2 ** 63 <= value < 2 ** 63:
+        out += b'q'
+        out += _long.pack(value)
+    else:
+        _write_pickle(out, value)
+
+
+def _write_text(out: bytearray, value: str):
+    code = _symbol_codes.get(value)
+    if code is None:
+        out += b's'
+        _write_str(out, value)
+    else:
+        out += b'Y'
+        out.append(code)
+
+
+def _write_items(tag: bytes):
+    def write(out: bytearray, values):
+        out += tag
+        _write_length(out, len(values))
+        for value in values:
+            _write(out, value)
+    return write
+
+
+def _write_dict(out: bytearray, values: dict):
+    out += b'd'
+    _write_length(out, len(values))
+    for key, value in values.items():
+        _write(out, key)
+        _write(out, value)
+
+
+def _write_player(out: bytearray, value: Player):
+    out += b'P'
+    _write_str(out, value.name)
+    _write_str(out, value.initials)
+    out += _color.pack(*value.color)
+
+
+def _write_live_player(out: bytearray, value: LivePlayer):
+    out += b'L'
+    _write_player(out, value.player)
+    _write_text(out, value.legend)
+
+
+def _write_score(out: bytearray, value: Score):
+    try:
+        packed = _score.pack(value.rank, value.score, value.kos, value.falls,
+                             value.accidents, value.dmg_done, value.dmg_taken)
+    except struct.error:
+        _write_pickle(out, value)
+        return
+    out += b'R'
+    out += packed
+
+
+def _write_pickle(out: bytearray, value: Any):
+    encoded = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    out += b'p'
+    _write_length(out, len(encoded))
+    out += encoded
+
+
+def _write_bytes(out: bytearray, value: bytes):
+    out += b'y'
+    _write_length(out, len(value))
+    out += value
+
+
+_writers = {
+    type(None): lambda out, _: out.extend(b'N'),
+    bool: lambda out, value: out.extend(b'T' if value else b'F'),
+    int: _write_int,
+    float: lambda out, value: out.extend(b'f' + _float.pack(value)),
+    str: _write_text,
+    bytes: _write_bytes,
+    list: _write_items(b'l'),
+    tuple: _write_items(b't'),
+    set: _write_items(b'S'),
+    frozenset: _write_items(b'S'),
+    dict: _write_dict,
+    Color: lambda out, value: out.extend(b'C' + _color.pack(*value)),
+    Player: _write_player,
+    LivePlayer: _write_live_player,
+    Score: _write_score,
+}
+
+
+def _write(out: bytearray, value: Any):
+    writer = _writers.get(type(value))
+    if writer is None:
+        _write_pickle(out, value)
+    else:
+        writer(out, value)
+
+
+def _read(view: memoryview, offset: int) -> (Any, int):
+    tag = view[offset]
+    offset += 1
+    if tag == 78:  # N
+        return None, offset
+    elif tag == 84:  # T
+        return True, offset
+    elif tag == 70:  # F
+        return False, offset
+    elif tag == 98:  # b
+        return _byte.unpack_from(view, offset)[0], offset + 1
+    elif tag == 105:  # i
+        return _int.unpack_from(view, offset)[0], offset + 4
+    elif tag == 113:  # q
+        return _long.unpack_from(view, offset)[0], offset + 8
+    elif tag == 102:  # f
+        return _float.unpack_from(view, offset)[0], offset + 8
+    elif tag == 115:  # s
+        return _read_str(view, offset)
+    elif tag == 89:  # Y
+        return Symbols[view[offset]], offset + 1
+    elif tag in (108, 116, 83):  # l t S
+        length, offset = _read_length(view, offset)
+        values = []
+        for _ in range(length):
+            value, offset = _read(view, offset)
+            values.append(value)
+        return (values if tag == 108 else tuple(values) if tag == 116 else set(values)), offset
+    elif tag == 100:  # d
+        length, offset = _read_length(view, offset)
+        values = {}
+        for _ in range(length):
+            key, offset = _read(view, offset)
+            values[key], offset = _read(view, offset)
+        return values, offset
+    elif tag == 67:  # C
+        return Color(*_color.unpack_from(view, offset)), offset + 3
+    elif tag == 80:  # P
+        name, offset = _read_str(view, offset)
+        initials, offset = _read_str(view, offset)
+        return Player(name, initials, Color(*_color.unpack_from(view, offset))), offset + 3
+    elif tag == 76:  # L
+        player, offset = _read(view, offset)
+        legend, offset = _read(view, offset)
+        return LivePlayer(player, legend), offset
+    elif tag == 82:  # R
+        rank, *data = _score.unpack_from(view, offset)
+        return Score(rank, tuple(data)), offset + _score.size
+    elif tag == 121:  # y
+        length, offset = _read_length(view, offset)
+        return view[offset:offset + length].tobytes(), offset + length
+    elif tag == 112:  # p
+        length, offset = _read_length(view, offset)
+        return pickle.loads(view[offset:offset + length]), offset + length
+    raise ValueError('Unknown wire tag %r' % chr(tag))
+
+# endregion